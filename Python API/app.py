@@ -16,7 +16,11 @@ database = "macromed"
 engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}/{database}")
 
 # Load product data
-products_df = pd.read_sql("SELECT * FROM products", engine)
+products_df = pd.read_sql(
+    "SELECT product_id, product_name, description, category, subcategory, brand, "
+    "material, price, image_url, product_url FROM products",
+    engine,
+)
 rec = Recommendations(products_df)
 
 
@@ -1,20 +1,5 @@
-import pandas as pd
-from sqlalchemy import create_engine
-import os
 import sys
 
-# Replace with your credentials
-host = "localhost"
-user = "root"
-password = ""  # leave blank if no password
-database = "macromed"
-
-# Create engine
-engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}/{database}")
-
-# Load products table
-products_df = pd.read_sql("SELECT * FROM products", engine)
-
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from IPython.display import HTML
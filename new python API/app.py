@@ -1,105 +1,407 @@
-from flask import Flask, request, jsonify
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
-from sqlalchemy import create_engine
-import pandas as pd
-from recommendations import Recommendations
+from recommendations import RECOMMENDATION_TYPES, Recommendations
+from model_store import current_version_path, load_model
+from model_refresh import ModelRefresher
+from data_sources import open_source
+from db import DATABASE_URL
+from response_cache import ResponseCache
+from metrics import CONTENT_TYPE, Histogram, InFlight, render_family
+import stage_timing
+from stage_timing import stage
 
 # Flask app setup
 app = Flask(__name__)
 CORS(app)
 
-# PostgreSQL DB credentials
-host = "localhost"
-port = 5432
-user = "postgres"
-password = "1234"
-database = "Macromed"
+# Prebuilt model artifact; when present it is memory-mapped instead of
+# rebuilding the model from the database in every worker
+model_dir = os.environ.get("MACROMED_MODEL_DIR", "model")
+
+# Products and interactions are read from MACROMED_DATA_SOURCE when set: a
+# Parquet snapshot directory (see data_sources.py) or another database URL.
+# Otherwise they come from the shared, pooled engine for MACROMED_DATABASE_URL
+# (PostgreSQL by default; see db.py), which every refresh reuses.
+data_source = open_source(os.environ.get("MACROMED_DATA_SOURCE", DATABASE_URL))
 
-# Create SQLAlchemy engine
-engine = create_engine(
-    f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
+# Limits for POST /api/recommend/batch
+max_batch_size = int(os.environ.get("MACROMED_MAX_BATCH", "100"))
+max_top_n = 50
+
+# Serialized /api/recommend responses kept per model generation
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("MACROMED_CACHE_ENTRIES", "10000")),
+    max_bytes=int(os.environ.get("MACROMED_CACHE_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.environ.get("MACROMED_CACHE_TTL", "300")),
 )
 
-# Load products and interactions tables
-try:
-    products_df = pd.read_sql("SELECT * FROM products", engine)
-    interactions_df = pd.read_sql("SELECT * FROM interactions", engine)
-except Exception as e:
-    print(f"❌ Error loading tables: {e}")
-    products_df = pd.DataFrame()
-    interactions_df = pd.DataFrame()
+# Per-stage request timings, as a Server-Timing response header and/or one
+# JSON log line per request; both are off by default
+server_timing = os.environ.get("MACROMED_SERVER_TIMING") == "1"
+timing_log = os.environ.get("MACROMED_TIMING_LOG") == "1"
+timing_logger = logging.getLogger("macromed.timing")
+if timing_log and not timing_logger.handlers:
+    timing_logger.addHandler(logging.StreamHandler())
+    timing_logger.setLevel(logging.INFO)
+
+# Seconds between scheduled model rebuilds (0 = only on SIGHUP)
+refresh_seconds = float(os.environ.get("MACROMED_REFRESH_SECONDS", "0"))
+
+# "delta" refreshes upsert changed products and fetch only interactions past
+# the model's watermark, merging both into the current model; "full"
+# reloads everything
+ingest_mode = os.environ.get("MACROMED_INGEST", "full")
+
+
+def update_model(model):
+    # Upsert new or edited products with the existing vocabulary; removals
+    # or too much vocabulary drift need a full rebuild (returns None)
+    products_df = data_source.load_products()
+    changes, removed = model.product_changes(products_df)
+    if len(removed):
+        return None
+    if len(changes):
+        model = model.with_products(changes)
+        if model.needs_refit:
+            return None
+
+    new_interactions = data_source.load_interactions(after=model.interaction_watermark)
+    if new_interactions.count:
+        model = model.with_interactions(new_interactions)
+    return model
+
+
+# Artifact version most recently loaded, so that a model rebuilt on top of
+# it is not replaced by the same version again
+loaded_version = None
+
+
+def build_model(current):
+    global loaded_version
+
+    # A published artifact wins; reload only when a new version appears
+    version = current_version_path(model_dir)
+    if version and version != loaded_version:
+        loaded_version = version
+        return load_model(version), version
+
+    if (
+        current is not None
+        and ingest_mode == "delta"
+        and current.model.interaction_watermark is not None
+    ):
+        model = update_model(current.model)
+        if model is current.model:
+            return None
+        if model is not None:
+            return model, current.source
+
+    elif version:
+        return None
 
-# Initialize recommendation engine
-rec = Recommendations(products_df, interactions_df)
+    # Load products and interactions tables
+    try:
+        products_df = data_source.load_products()
+        interactions = data_source.load_interactions()
+    except Exception as e:
+        print(f"❌ Error loading tables: {e}")
+        raise
+
+    # Initialize recommendation engine
+    return Recommendations(products_df, interactions), "database"
+
+
+# Build the first model now, then keep refreshing it in the background.
+# Handlers read the model once per request, so a swap never affects a
+# request that is already running.
+refresher = ModelRefresher(build_model, interval=refresh_seconds)
+refresher.refresh()
+refresher.install_signal_handler()
+refresher.start()
+
+# Request metrics exported by /api/metrics
+request_latency = Histogram(
+    "macromed_request_duration_seconds",
+    "Recommendation request latency by endpoint, type and HTTP status.",
+    ("endpoint", "type", "status"),
+)
+in_flight = InFlight()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    in_flight.add(1)
+    if server_timing or timing_log:
+        g.stage_timer, g.stage_token = stage_timing.start()
+
+
+@app.after_request
+def record_request_latency(response):
+    if request.endpoint in ("recommend", "recommend_batch"):
+        if request.endpoint == "recommend_batch":
+            rec_type = "batch"
+        else:
+            rec_type = request.args.get("type", "content")
+            rec_type = rec_type if rec_type in RECOMMENDATION_TYPES else "invalid"
+        request_latency.observe(
+            (request.endpoint, rec_type, str(response.status_code)),
+            time.perf_counter() - g.request_started,
+        )
+
+    timer = g.get("stage_timer")
+    if timer is not None:
+        if server_timing:
+            response.headers["Server-Timing"] = timer.server_timing()
+        if timing_log:
+            timing_logger.info(
+                json.dumps(
+                    {
+                        "method": request.method,
+                        "path": request.path,
+                        "type": request.args.get("type"),
+                        "status": response.status_code,
+                        "stages_ms": timer.milliseconds(),
+                    }
+                )
+            )
+    return response
+
+
+@app.teardown_request
+def finish_request(exc=None):
+    in_flight.add(-1)
+    if "stage_token" in g:
+        stage_timing.stop(g.pop("stage_token"))
 
 
 @app.route("/api/recommend", methods=["GET"])
 def recommend():
+    state = refresher.current()
+    rec = state.model
     rec_type = request.args.get("type", "content")  # content, price, cf, personalized
 
-    # Personalized Recommendation (user’s own interaction history)
-    if rec_type == "personalized":
-        user_id = request.args.get("user_id")
-        if not user_id:
-            return jsonify({"error": "Missing user_id"}), 400
-        try:
-            user_id = int(user_id)
-        except ValueError:
-            return jsonify({"error": "Invalid user_id"}), 400
-
-        df = rec.get_personalized_recommendations(user_id)
-        if isinstance(df, str):
-            return jsonify({"error": df}), 404
-        return jsonify(df.to_dict(orient="records"))
-
-    # Collaborative Filtering (user-to-user)
-    elif rec_type == "cf":
-        user_id = request.args.get("user_id")
-        if not user_id:
-            return jsonify({"error": "Missing user_id"}), 400
-        try:
-            user_id = int(user_id)
-        except ValueError:
-            return jsonify({"error": "Invalid user_id"}), 400
-
-        df = rec.get_user_to_user_recommendations(user_id)
-        if isinstance(df, str):
-            return jsonify({"error": df}), 404
-        return jsonify(df.to_dict(orient="records"))
-
-    # Content-based or price-based
-    else:
-        product_id = request.args.get("product_id")
-        if not product_id:
-            return jsonify({"error": "Missing product_id"}), 400
-        try:
-            product_id = int(product_id)
-        except ValueError:
-            return jsonify({"error": "Invalid product_id"}), 400
-
-        if rec_type == "content":
-            df = rec.get_product_to_product_recommendations(product_id)
-        elif rec_type == "price":
-            df = rec.get_price_based_recommendations(product_id)
+    # Personalized and collaborative filtering are keyed by user,
+    # content-based and price-based by product
+    id_field = "user_id" if rec_type in ("personalized", "cf") else "product_id"
+    entry_id = request.args.get(id_field)
+    if not entry_id:
+        return jsonify({"error": f"Missing {id_field}"}), 400
+    try:
+        entry_id = int(entry_id)
+    except ValueError:
+        return jsonify({"error": f"Invalid {id_field}"}), 400
+
+    if rec_type not in RECOMMENDATION_TYPES:
+        return jsonify({"error": "Invalid type"}), 400
+    same_category = request.args.get("same_category", "").lower()
+    same_category = rec_type == "price" and same_category in ("1", "true", "yes")
+
+    # Serve repeated requests from the response cache of this generation
+    key = (rec_type, entry_id, 5, same_category)
+    with stage("cache"):
+        cached = response_cache.get(key, state.generation)
+    if cached is None:
+        result = rec.get_recommendation_rows(
+            rec_type, [entry_id], same_category=same_category
+        )[0]
+        if isinstance(result, str):
+            cached = (jsonify({"error": result}).get_data(), 404)
+        else:
+            # Joined from the model's precomputed per-product JSON fragments
+            cached = (rec.render_json(result), 200)
+        response_cache.put(key, state.generation, cached, len(cached[0]))
+
+    body, status = cached
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+def parse_batch_entry(entry):
+    # (type, id, top_n, same_category) for one batch entry, or an error
+    if not isinstance(entry, dict):
+        return "Invalid entry"
+
+    rec_type = entry.get("type", "content")
+    if rec_type not in RECOMMENDATION_TYPES:
+        return "Invalid type"
+
+    id_field = "user_id" if rec_type in ("cf", "personalized") else "product_id"
+    if entry.get(id_field) in (None, ""):
+        return f"Missing {id_field}"
+    try:
+        entry_id = int(entry[id_field])
+    except (TypeError, ValueError):
+        return f"Invalid {id_field}"
+
+    try:
+        top_n = int(entry.get("top_n", 5))
+    except (TypeError, ValueError):
+        top_n = 0
+    if not 1 <= top_n <= max_top_n:
+        return f"top_n must be between 1 and {max_top_n}"
+
+    same_category = str(entry.get("same_category", "")).lower()
+    return rec_type, entry_id, top_n, same_category in ("1", "true", "yes")
+
+
+@app.route("/api/recommend/batch", methods=["POST"])
+def recommend_batch():
+    # {"requests": [{"type": ..., "product_id" | "user_id": ..., "top_n": ...}]}
+    # gets {"results": [...]} back in the same order, each entry holding
+    # either "recommendations" or "error"
+    rec = refresher.current().model
+    payload = request.get_json(silent=True)
+    entries = payload.get("requests") if isinstance(payload, dict) else None
+    if not isinstance(entries, list):
+        return jsonify({"error": "Expected a JSON object with a requests list"}), 400
+    if len(entries) > max_batch_size:
+        return jsonify({"error": f"At most {max_batch_size} requests per batch"}), 400
+
+    results = [None] * len(entries)
+    groups = {}
+    for position, entry in enumerate(entries):
+        parsed = parse_batch_entry(entry)
+        if isinstance(parsed, str):
+            results[position] = parsed
         else:
-            return jsonify({"error": "Invalid type"}), 400
+            rec_type, entry_id, top_n, same_category = parsed
+            groups.setdefault((rec_type, same_category), []).append(
+                (position, entry_id, top_n)
+            )
+
+    # One engine call per type for the whole batch; every type except the
+    # price walk (already O(top_n) per entry) is scored vectorized
+    for (rec_type, same_category), group in groups.items():
+        positions, ids, top_ns = zip(*group)
+        rows = rec.get_recommendation_rows(
+            rec_type, list(ids), list(top_ns), same_category
+        )
+        for position, result in zip(positions, rows):
+            results[position] = result
 
-        if isinstance(df, str):
-            return jsonify({"error": df}), 404
-        return jsonify(df.to_dict(orient="records"))
+    parts = [
+        (
+            json.dumps({"error": result}).encode()
+            if isinstance(result, str)
+            else b'{"recommendations":' + rec.render_json(result) + b"}"
+        )
+        for result in results
+    ]
+    return app.response_class(
+        b'{"results":[' + b",".join(parts) + b"]}", mimetype="application/json"
+    )
 
 
 @app.route("/api/health", methods=["GET"])
 def health_check():
+    state = refresher.current()
     return jsonify(
         {
             "status": "ok",
-            "products_loaded": len(products_df),
-            "interactions_loaded": len(interactions_df),
+            "products_loaded": len(state.model.products_df),
+            "interactions_loaded": state.model.interaction_count,
+            "model_generation": state.generation,
+            "model_built_at": state.built_at.isoformat(),
+            "model_build_seconds": state.build_seconds,
+            "model_source": state.source,
+            "response_cache": response_cache.stats(),
+            "database_pool": data_source.pool_stats(),
         }
     )
 
 
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    state = refresher.current()
+    model = state.model
+    cache = response_cache.stats()
+    lookups = cache["hits"] + cache["misses"]
+    matrices = model.matrix_stats()
+
+    lines = request_latency.render()
+    lines += render_family(
+        "macromed_requests_in_flight",
+        "gauge",
+        "Requests currently being handled.",
+        {(): in_flight.value},
+    )
+    for name in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        lines += render_family(
+            f"macromed_response_cache_{name}_total",
+            "counter",
+            f"Response cache {name}.",
+            {(): cache[name]},
+        )
+    lines += render_family(
+        "macromed_response_cache_hit_ratio",
+        "gauge",
+        "Response cache hits per lookup since start.",
+        {(): cache["hits"] / lookups if lookups else 0.0},
+    )
+    lines += render_family(
+        "macromed_response_cache_entries",
+        "gauge",
+        "Responses currently cached.",
+        {(): cache["entries"]},
+    )
+    lines += render_family(
+        "macromed_response_cache_bytes",
+        "gauge",
+        "Bytes of cached responses.",
+        {(): cache["bytes"]},
+    )
+    lines += render_family(
+        "macromed_model_generation",
+        "gauge",
+        "Generation of the serving model.",
+        {(): state.generation},
+    )
+    lines += render_family(
+        "macromed_model_build_seconds",
+        "gauge",
+        "Time taken to build or load the serving model.",
+        {(): state.build_seconds},
+    )
+    lines += render_family(
+        "macromed_model_age_seconds",
+        "gauge",
+        "Seconds since the serving model was swapped in.",
+        {(): (datetime.now(timezone.utc) - state.built_at).total_seconds()},
+    )
+    lines += render_family(
+        "macromed_model_rows",
+        "gauge",
+        "Products, users and interactions in the serving model.",
+        {
+            "products": len(model.products_df),
+            "users": len(model.user_ids) if model.user_item_matrix is not None else 0,
+            "interactions": model.interaction_count,
+        },
+        ("kind",),
+    )
+    lines += render_family(
+        "macromed_matrix_nnz",
+        "gauge",
+        "Stored entries per model matrix.",
+        {name: nnz for name, (nnz, _) in matrices.items()},
+        ("matrix",),
+    )
+    lines += render_family(
+        "macromed_matrix_bytes",
+        "gauge",
+        "Bytes held by each model matrix (memory-mapped for loaded artifacts).",
+        {name: size for name, (_, size) in matrices.items()},
+        ("matrix",),
+    )
+    return app.response_class("\n".join(lines) + "\n", content_type=CONTENT_TYPE)
+
+
 # Run the Flask server
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
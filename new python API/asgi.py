@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+ASGI entry point for the Python Recommendation API.
+
+    uvicorn asgi:application --port 5000
+
+Exposes the same routes as app.py. Connections, including idle keep-alive
+ones, are held by the ASGI server's event loop; only a request that is being
+answered occupies a thread. Handlers run on a bounded thread pool, where the
+NumPy/SciPy scoring releases the GIL. Requests beyond the pool plus the
+queue depth are refused with 503 straight away instead of piling up.
+"""
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, refresher
+
+# Threads running request handlers
+worker_threads = int(
+    os.environ.get("MACROMED_WORKER_THREADS", str(min(8, os.cpu_count() or 1)))
+)
+
+# Requests allowed to wait for a free thread before new ones get 503
+queue_depth = int(os.environ.get("MACROMED_QUEUE_DEPTH", "64"))
+
+# Largest request body accepted (batch requests are the only ones with a body)
+max_body_bytes = 1024 * 1024
+
+BUSY_BODY = b'{"error":"Server busy, retry shortly"}'
+TOO_LARGE_BODY = b'{"error":"Request body too large"}'
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope and its full request body"""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = "HTTP_" + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, scope, body):
+    """Run wsgi_app for one request; returns (status, headers, body)"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    result = wsgi_app(wsgi_environ(scope, body), start_response)
+    try:
+        content = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in started["headers"]
+    ]
+    return started["status"], headers, content
+
+
+class BoundedExecutorApp:
+    """ASGI application running a WSGI app on a bounded thread pool"""
+
+    def __init__(self, wsgi_app, threads, queue_depth, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="recommend")
+        self.capacity = threads + queue_depth
+        self.on_shutdown = on_shutdown
+        # Requests running or queued; only touched from the event loop
+        self.pending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if len(body) > max_body_bytes:
+                await self._send(send, 413, [], TOO_LARGE_BODY)
+                return
+            if not message.get("more_body"):
+                break
+
+        if self.pending >= self.capacity:
+            await self._send(send, 503, [(b"retry-after", b"1")], BUSY_BODY)
+            return
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            status, headers, content = await loop.run_in_executor(
+                self.executor, call_wsgi, self.wsgi_app, scope, body
+            )
+        finally:
+            self.pending -= 1
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": content})
+
+    async def _send(self, send, status, headers, content):
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(content)).encode()),
+            *headers,
+        ]
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.on_shutdown:
+                    self.on_shutdown()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = BoundedExecutorApp(
+    app, worker_threads, queue_depth, on_shutdown=refresher.stop
+)
+
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ ASGI mode needs uvicorn: pip install uvicorn")
+        sys.exit(1)
+
+    uvicorn.run(
+        application,
+        host=os.environ.get("MACROMED_HOST", "127.0.0.1"),
+        port=int(os.environ.get("MACROMED_PORT", "5000")),
+    )
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Synthetic benchmark for the recommendation engine.
+
+Generates catalogs and interaction logs of a given scale, builds the model
+with the offline pipeline (build_model.ModelBuilder) and times the four
+single-item recommendation methods. Results are written as JSON tagged with
+the git commit, so runs on different commits can be compared:
+
+    python benchmark.py --scales xs,s
+    python benchmark.py --scales xs,s --compare benchmark_results/<old>.json
+
+Each scale runs in its own process, so its peak RSS is not inflated by the
+scales before it.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from build_model import ModelBuilder, peak_rss_mb
+from loaders import compact_products
+from recommendations import DEFAULT_NEIGHBOR_K, InteractionBuffer
+
+# name -> (products, interaction events)
+SCALES = {
+    "xs": (2_000, 10_000),
+    "s": (20_000, 200_000),
+    "m": (100_000, 2_000_000),
+    "l": (250_000, 10_000_000),
+    "xl": (500_000, 50_000_000),
+}
+
+# Real product titles used to seed the vocabulary, when present
+TITLES_CSV = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "cleaned_surgical_tools.csv"
+)
+
+# Share of each interaction type in the generated log
+INTERACTION_MIX = {
+    "view": 0.55,
+    "search": 0.15,
+    "add_to_cart": 0.1,
+    "wishlist": 0.07,
+    "compare": 0.05,
+    "purchase": 0.08,
+}
+
+# Zipf exponents for product popularity, user activity and word frequency
+PRODUCT_ZIPF = 1.0
+USER_ZIPF = 0.8
+WORD_ZIPF = 1.05
+
+# Average interactions per user
+EVENTS_PER_USER = 25
+
+# Words per category topic; a share of every text is drawn from its topic
+TOPIC_WORDS = 300
+TOPIC_SHARE = 0.5
+
+# Interaction rows generated per chunk
+EVENT_CHUNK_ROWS = 1_000_000
+
+METHODS = {
+    "product_to_product": "get_product_to_product_recommendations",
+    "price": "get_price_based_recommendations",
+    "user_to_user": "get_user_to_user_recommendations",
+    "personalized": "get_personalized_recommendations",
+}
+
+_SYLLABLES = [
+    c + v
+    for c in "bcdfghklmnprstvz"
+    for v in ("a", "e", "i", "o", "u", "ar", "en", "is", "on", "ux")
+]
+
+
+class ZipfSampler:
+    """Ranks 0..n-1 drawn with probability proportional to 1 / (rank + 1) ** s"""
+
+    def __init__(self, n, s):
+        weights = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** s
+        self.cdf = np.cumsum(weights)
+        self.cdf /= self.cdf[-1]
+
+    def __call__(self, rng, size):
+        ranks = np.searchsorted(self.cdf, rng.random(size), side="right")
+        return np.minimum(ranks, len(self.cdf) - 1)
+
+
+def attribute_cardinalities(products):
+    """Distinct values per attribute, growing sublinearly with the catalog"""
+    categories = int(np.clip(products**0.5 / 2, 20, 400))
+    return {
+        "category": categories,
+        "subcategory": categories * 6,
+        "brand": int(np.clip(products / 100, 50, 5000)),
+        "material": 15,
+    }
+
+
+def make_vocabulary(rng, size):
+    """Words from real product titles, topped up with pseudo-words"""
+    words = []
+    if os.path.exists(TITLES_CSV):
+        titles = pd.read_csv(TITLES_CSV, usecols=["Title"])["Title"].dropna()
+        tokens = re.findall(r"[A-Za-z]{3,}", " ".join(titles).lower())
+        words = list(dict.fromkeys(tokens))
+
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(_SYLLABLES, rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return np.array(rng.permutation(words[:size]), dtype=object)
+
+
+def make_texts(rng, vocabulary, topics, lengths):
+    """One text per row, mixing topic words with globally frequent ones"""
+    word_ranks = ZipfSampler(len(vocabulary), WORD_ZIPF)
+    topic_ranks = ZipfSampler(TOPIC_WORDS, WORD_ZIPF)
+    width = int(lengths.max())
+    rows = len(lengths)
+
+    words = word_ranks(rng, (rows, width))
+    topic_start = topics[:, None] * TOPIC_WORDS % len(vocabulary)
+    topical = rng.random((rows, width)) < TOPIC_SHARE
+    words[topical] = (
+        (topic_start + topic_ranks(rng, (rows, width))) % len(vocabulary)
+    )[topical]
+
+    tokens = vocabulary[words]
+    return [" ".join(row[:length]) for row, length in zip(tokens, lengths)]
+
+
+def make_products(rng, products):
+    """Synthetic products table in the dtypes load_products() returns"""
+    cardinality = attribute_cardinalities(products)
+    vocabulary = make_vocabulary(rng, int(np.clip(30 * products**0.6, 3000, 200_000)))
+
+    # Subcategories and most brands belong to one category
+    category = ZipfSampler(cardinality["category"], 0.7)(rng, products)
+    subcategory = (category * 6 + rng.integers(0, 6, products)) % cardinality[
+        "subcategory"
+    ]
+    brand = ZipfSampler(cardinality["brand"], 1.1)(rng, products)
+    material = ZipfSampler(cardinality["material"], 1.2)(rng, products)
+
+    names = make_texts(rng, vocabulary, category, rng.integers(3, 8, products))
+    skus = rng.choice(1_000_000, products, replace=False)
+    names = [f"{name} | SM{sku:06d}" for name, sku in zip(names, skus)]
+
+    # Log-normal prices around a per-category level
+    level = rng.uniform(2.0, 6.0, cardinality["category"])
+    price = np.round(np.exp(rng.normal(level[category], 0.8)), 2)
+
+    product_id = np.arange(1, products + 1)
+    products_df = pd.DataFrame(
+        {
+            "product_id": product_id,
+            "product_name": names,
+            "description": make_texts(
+                rng, vocabulary, category, rng.integers(15, 41, products)
+            ),
+            "category": [f"Category {i}" for i in category],
+            "subcategory": [f"Subcategory {i}" for i in subcategory],
+            "brand": [f"Brand {i}" for i in brand],
+            "material": [f"Material {i}" for i in material],
+            "price": price,
+            "image_url": [f"https://example.com/images/{i}.jpg" for i in product_id],
+            "product_url": [f"https://example.com/products/{i}" for i in product_id],
+        }
+    )
+    return compact_products(products_df)
+
+
+def interaction_chunks(rng, product_ids, users, events, chunk_rows=EVENT_CHUNK_ROWS):
+    """Yield an interactions log with Zipf popularity and user activity"""
+    popularity = rng.permutation(product_ids)
+    activity = rng.permutation(np.arange(1, users + 1))
+    product_ranks = ZipfSampler(len(product_ids), PRODUCT_ZIPF)
+    user_ranks = ZipfSampler(users, USER_ZIPF)
+    types = pd.Categorical(list(INTERACTION_MIX))
+    mix = np.array(list(INTERACTION_MIX.values()))
+    mix /= mix.sum()
+
+    for start in range(0, events, chunk_rows):
+        size = min(chunk_rows, events - start)
+        yield pd.DataFrame(
+            {
+                "id": np.arange(start + 1, start + size + 1),
+                "user_id": activity[user_ranks(rng, size)],
+                "product_id": popularity[product_ranks(rng, size)],
+                "interaction_type": types.take(rng.choice(len(mix), size, p=mix)),
+            }
+        )
+
+
+def latency_stats(samples_ns):
+    samples = np.asarray(samples_ns) / 1e6
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "mean_ms": round(float(samples.mean()), 4),
+        "max_ms": round(float(samples.max()), 4),
+    }
+
+
+def query_ids(rec, rng, queries):
+    """Users and products to query, as often as they appear in interactions"""
+    matrix = rec.user_item_matrix
+    activity = np.diff(matrix.indptr).astype(np.float64)
+    users = rec.user_ids[
+        rng.choice(len(activity), queries, p=activity / activity.sum())
+    ]
+
+    # Products nobody interacted with still get the odd request
+    popularity = np.bincount(matrix.indices, minlength=matrix.shape[1]) + 1.0
+    rows = rng.choice(len(popularity), queries, p=popularity / popularity.sum())
+    products = rec.products_df["product_id"].to_numpy()[rows]
+    return users.tolist(), products.tolist()
+
+
+def time_method(method, ids, warmup):
+    """Per-call latencies of method over ids, after a few untimed calls"""
+    for item in ids[:warmup]:
+        method(item)
+
+    samples = []
+    errors = 0
+    for item in ids:
+        started = time.perf_counter_ns()
+        result = method(item)
+        samples.append(time.perf_counter_ns() - started)
+        errors += isinstance(result, str)
+    return {"calls": len(ids), "errors": errors, **latency_stats(samples)}
+
+
+def run_scale(scale, products, events, queries, neighbor_k, seed):
+    """Generate, build and time one scale; runs in a fresh process"""
+    rng = np.random.default_rng(seed)
+    users = max(100, events // EVENTS_PER_USER)
+
+    # Generated up front, as a data source would hand it over, so the
+    # build timings below do not include producing the synthetic log
+    started = time.perf_counter()
+    products_df = make_products(rng, products)
+    interactions = InteractionBuffer.from_frames(
+        interaction_chunks(rng, products_df["product_id"].to_numpy(), users, events)
+    )
+    generated = time.perf_counter() - started
+
+    builder = ModelBuilder(cache=None, neighbor_k=neighbor_k)
+    started = time.perf_counter()
+    rec = builder.build(products_df, interactions)
+    build_seconds = time.perf_counter() - started
+
+    user_ids, product_ids = query_ids(rec, rng, queries)
+    latency = {}
+    for name, method in METHODS.items():
+        ids = user_ids if name in ("user_to_user", "personalized") else product_ids
+        latency[name] = time_method(getattr(rec, method), ids, warmup=min(20, queries))
+
+    return {
+        "scale": scale,
+        "products": products,
+        "events": events,
+        "users": int(len(rec.user_ids)),
+        "generate_seconds": round(generated, 3),
+        "build_seconds": round(build_seconds, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": [
+            {key: stage[key] for key in ("stage", "seconds", "peak_rss_mb")}
+            for stage in builder.stages
+        ],
+        "matrices": {
+            name: {"nnz": nnz, "bytes": size}
+            for name, (nnz, size) in rec.matrix_stats().items()
+        },
+        "latency": latency,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import scipy
+    import sklearn
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+        "sklearn": sklearn.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline):
+    """Lines of current vs. baseline figures for the scales both runs have"""
+    previous = {run["scale"]: run for run in baseline["results"]}
+    lines = [f"Compared with {baseline.get('commit') or 'baseline'}:"]
+
+    for run in results:
+        old = previous.get(run["scale"])
+        if old is None:
+            continue
+        figures = [
+            ("build_seconds", run["build_seconds"], old["build_seconds"]),
+            ("peak_rss_mb", run["peak_rss_mb"], old["peak_rss_mb"]),
+        ]
+        for name, now in run["latency"].items():
+            before = old["latency"].get(name)
+            if before is not None:
+                for stat in ("p50_ms", "p99_ms"):
+                    figures.append((f"{name}.{stat}", now[stat], before[stat]))
+
+        lines.append(f"  {run['scale']}")
+        for label, now, before in figures:
+            if now is None or not before:
+                continue
+            change = (now - before) / before
+            lines.append(f"    {label:<26} {now:>10} vs {before:<10} ({change:+.1%})")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scales",
+        default="xs,s",
+        help=f"comma-separated presets from {', '.join(SCALES)}",
+    )
+    parser.add_argument("--products", type=int, help="custom scale: number of products")
+    parser.add_argument(
+        "--events", type=int, help="custom scale: number of interactions"
+    )
+    parser.add_argument("--queries", type=int, default=1000, help="calls per method")
+    parser.add_argument("--neighbor-k", type=int, default=DEFAULT_NEIGHBOR_K)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="results file (default benchmark_results/)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    if args.products or args.events:
+        if not (args.products and args.events):
+            parser.error("--products and --events go together")
+        scales = {"custom": (args.products, args.events)}
+    else:
+        names = [name.strip() for name in args.scales.split(",") if name.strip()]
+        unknown = [name for name in names if name not in SCALES]
+        if unknown:
+            parser.error(f"unknown scales: {', '.join(unknown)}")
+        scales = {name: SCALES[name] for name in names}
+
+    commit = git_commit()
+    started = datetime.now(timezone.utc)
+    results = []
+    for scale, (products, events) in scales.items():
+        print(f"⏳ {scale}: {products:,} products, {events:,} interactions")
+        # A fresh process per scale keeps peak RSS figures independent
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            run = pool.submit(
+                run_scale,
+                scale,
+                products,
+                events,
+                args.queries,
+                args.neighbor_k,
+                args.seed,
+            ).result()
+        results.append(run)
+
+        print(
+            f"  generate {run['generate_seconds']:>6.3f}s"
+            f"  build {run['build_seconds']:>9.3f}s  peak RSS {run['peak_rss_mb']} MB"
+        )
+        for name, stats in run["latency"].items():
+            print(
+                f"  {name:<20} p50 {stats['p50_ms']:>8.3f} ms"
+                f"  p99 {stats['p99_ms']:>8.3f} ms"
+            )
+
+    report = {
+        "commit": commit,
+        "started_at": started.isoformat(),
+        "seed": args.seed,
+        "queries": args.queries,
+        "neighbor_k": args.neighbor_k,
+        "environment": environment(),
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        "benchmark_results",
+        f"{started:%Y%m%dT%H%M%S}-{(commit or 'nogit')[:10]}.json",
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(results, baseline)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Offline model build for the Python Recommendation API.
+
+Runs the pipeline load -> text features -> TF-IDF -> neighbors -> result
+fragments -> user CF and publishes the result as a model artifact (see
+model_store.py). Every stage after load is keyed by a content hash of its
+inputs and parameters, and its output is cached, so a rebuild only
+recomputes the stages whose inputs actually changed.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import normalize
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from recommendations import (
+    DEFAULT_NEIGHBOR_K,
+    INTERACTION_WEIGHTS,
+    RESULT_COLUMNS,
+    TEXT_COLUMNS,
+    TFIDF_PARAMS,
+    USER_NEIGHBOR_K,
+    InteractionBuffer,
+    Recommendations,
+    combine_text,
+    fill_missing_text,
+)
+from data_sources import open_source
+from db import DATABASE_URL
+from model_store import ArrayReader, ArrayWriter, make_vectorizer, save_model
+
+STAGE_MANIFEST = "stage.json"
+
+# Cached outputs kept per stage; older keys are pruned after each store
+CACHE_KEEP = 3
+
+
+def content_hash(*parts):
+    """Stable hash over arrays/DataFrames/Series (by content) and JSON-able values"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(json.dumps([part.dtype.str, part.shape]).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (pd.DataFrame, pd.Series)):
+            columns = list(part.columns) if isinstance(part, pd.DataFrame) else []
+            digest.update(json.dumps(columns).encode())
+            hashed = pd.util.hash_pandas_object(part, index=False)
+            digest.update(hashed.to_numpy().tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:20]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, if the OS reports it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class StageCache:
+    """Stage outputs stored as <root>/<stage>/<key>/ array directories"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def load(self, stage, key):
+        path = os.path.join(self.root, stage, key)
+        try:
+            with open(os.path.join(path, STAGE_MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        return ArrayReader(path, manifest["arrays"], mmap=False)
+
+    def store(self, stage, key, save):
+        path = os.path.join(self.root, stage, key)
+        staging = path + ".tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        writer = ArrayWriter(staging)
+        save(writer)
+        with open(os.path.join(staging, STAGE_MANIFEST), "w") as f:
+            json.dump({"stage": stage, "key": key, "arrays": writer.arrays}, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(staging, path)
+        self._prune(stage)
+
+    def _prune(self, stage):
+        stage_dir = os.path.join(self.root, stage)
+        entries = sorted(
+            (os.path.join(stage_dir, name) for name in os.listdir(stage_dir)),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for stale in entries[CACHE_KEEP:]:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+class ModelBuilder:
+    """Builds a Recommendations engine stage by stage with a build report"""
+
+    def __init__(self, cache=None, neighbor_k=DEFAULT_NEIGHBOR_K):
+        self.cache = cache
+        self.neighbor_k = neighbor_k
+        self.stages = []
+
+    def _run_stage(self, name, key, compute, save, restore, stats):
+        started = time.perf_counter()
+        reader = self.cache.load(name, key) if self.cache and key else None
+        if reader is not None:
+            restore(reader)
+        else:
+            compute()
+            if self.cache and key:
+                self.cache.store(name, key, save)
+
+        self.stages.append(
+            {
+                "stage": name,
+                "key": key,
+                "cached": reader is not None,
+                "seconds": round(time.perf_counter() - started, 3),
+                "peak_rss_mb": peak_rss_mb(),
+                **stats(),
+            }
+        )
+
+    def load(self, source):
+        loaded = {}
+
+        def compute():
+            loaded["products"] = source.load_products()
+            loaded["interactions"] = source.load_interactions()
+
+        self._run_stage(
+            "load",
+            None,
+            compute,
+            None,
+            None,
+            lambda: {
+                "products": len(loaded["products"]),
+                "interactions": loaded["interactions"].count,
+            },
+        )
+        return loaded["products"], loaded["interactions"]
+
+    def build(self, products_df, interactions=None):
+        rec = Recommendations.__new__(Recommendations)
+        fill_missing_text(products_df)
+
+        # Text features
+        text_key = content_hash("text", products_df[TEXT_COLUMNS])
+
+        def compute_text():
+            products_df["combined_text"] = combine_text(products_df)
+
+        def save_text(writer):
+            writer.strings("combined_text", products_df["combined_text"])
+
+        def restore_text(reader):
+            products_df["combined_text"] = reader.strings("combined_text")
+
+        self._run_stage(
+            "text",
+            text_key,
+            compute_text,
+            save_text,
+            restore_text,
+            lambda: {"products": len(products_df)},
+        )
+        rec._set_products(products_df)
+
+        # TF-IDF
+        tfidf_key = content_hash("tfidf", text_key, TFIDF_PARAMS)
+
+        def save_tfidf(writer):
+            writer.strings("vocabulary", rec.tfidf.get_feature_names_out())
+            writer.array("idf", rec.tfidf.idf_)
+            writer.matrix("tfidf_matrix", rec.tfidf_matrix)
+
+        def restore_tfidf(reader):
+            rec.tfidf = make_vectorizer(
+                reader.strings("vocabulary"), reader.array("idf")
+            )
+            rec.tfidf_matrix = reader.matrix("tfidf_matrix")
+            rec._unit_matrix = normalize(rec.tfidf_matrix).tocsr()
+            rec.indexed_terms = int(rec.tfidf_matrix.nnz)
+            rec.oov_terms = 0
+
+        self._run_stage(
+            "tfidf",
+            tfidf_key,
+            lambda: rec._fit_tfidf(products_df["combined_text"]),
+            save_tfidf,
+            restore_tfidf,
+            lambda: {
+                "vocabulary": len(rec.tfidf.vocabulary_),
+                "nnz": int(rec.tfidf_matrix.nnz),
+            },
+        )
+        rec._drop_feature_text()
+
+        # Content neighbors
+        neighbors_key = content_hash(
+            "neighbors", tfidf_key, {"neighbor_k": self.neighbor_k}
+        )
+
+        def save_neighbors(writer):
+            writer.array("neighbor_indices", rec.neighbor_indices)
+            writer.array("neighbor_scores", rec.neighbor_scores)
+
+        def restore_neighbors(reader):
+            rec.neighbor_indices = reader.array("neighbor_indices")
+            rec.neighbor_scores = reader.array("neighbor_scores")
+            rec.neighbor_k = rec.neighbor_indices.shape[1]
+            rec._build_item_neighbor_matrix()
+
+        self._run_stage(
+            "neighbors",
+            neighbors_key,
+            lambda: rec._build_neighbors(self.neighbor_k),
+            save_neighbors,
+            restore_neighbors,
+            lambda: {
+                "neighbor_k": rec.neighbor_k,
+                "nnz": int(rec.neighbor_indices.size),
+            },
+        )
+
+        # Attribute codes, postings and the price index are cheap to derive
+        self._run_stage(
+            "indexes", None, rec._build_catalog_indexes, None, None, lambda: {}
+        )
+
+        # Serialized result fragments
+        fragments_key = content_hash("fragments", products_df[RESULT_COLUMNS])
+        self._run_stage(
+            "fragments",
+            fragments_key,
+            rec._build_fragments,
+            lambda writer: writer.strings("fragments", rec.fragments),
+            lambda reader: setattr(rec, "fragments", reader.strings("fragments")),
+            lambda: {"products": len(rec.fragments)},
+        )
+
+        # User CF
+        if interactions is None:
+            rec.user_item_matrix = None
+            rec.interaction_count = 0
+            rec.interaction_watermark = None
+            return rec
+
+        interactions = InteractionBuffer.from_frames(interactions)
+        user_cf_key = content_hash(
+            "user_cf",
+            *interactions.arrays(),
+            products_df["product_id"],
+            INTERACTION_WEIGHTS,
+            {"user_neighbor_k": USER_NEIGHBOR_K},
+        )
+
+        def save_user_cf(writer):
+            writer.array("user_ids", rec.user_ids)
+            writer.matrix("user_item", rec.user_item_matrix)
+            writer.array("interaction_count", np.array([rec.interaction_count]))
+            writer.array("user_neighbor_indices", rec.user_neighbor_indices)
+            writer.array("user_neighbor_scores", rec.user_neighbor_scores)
+
+        def restore_user_cf(reader):
+            rec._set_user_cf(
+                reader.array("user_ids"),
+                reader.matrix("user_item"),
+                int(reader.array("interaction_count")[0]),
+            )
+            rec.user_neighbor_indices = reader.array("user_neighbor_indices")
+            rec.user_neighbor_scores = reader.array("user_neighbor_scores")
+
+        self._run_stage(
+            "user_cf",
+            user_cf_key,
+            lambda: rec._prepare_user_cf(interactions),
+            save_user_cf,
+            restore_user_cf,
+            lambda: {
+                "users": len(rec.user_ids),
+                "nnz": int(rec.user_item_matrix.nnz),
+            },
+        )
+        rec.interaction_watermark = interactions.watermark
+        return rec
+
+    def report(self, started, artifact):
+        return {
+            "started_at": started.isoformat(),
+            "total_seconds": round(sum(stage["seconds"] for stage in self.stages), 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "artifact": artifact,
+            "stages": self.stages,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--database-url",
+        default=DATABASE_URL,
+    )
+    parser.add_argument(
+        "--source",
+        default=os.environ.get("MACROMED_DATA_SOURCE"),
+        help="Parquet snapshot directory to read instead of the database",
+    )
+    parser.add_argument(
+        "--output",
+        default=os.environ.get("MACROMED_MODEL_DIR", "model"),
+        help="artifact root; the new version is made current",
+    )
+    parser.add_argument("--cache-dir", default=".build_cache")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--neighbor-k", type=int, default=DEFAULT_NEIGHBOR_K)
+    parser.add_argument("--report", help="also write the build report here")
+    args = parser.parse_args()
+
+    started = datetime.now(timezone.utc)
+    cache = None if args.no_cache else StageCache(args.cache_dir)
+    builder = ModelBuilder(cache, neighbor_k=args.neighbor_k)
+
+    try:
+        source = open_source(args.source or args.database_url)
+        products_df, interactions = builder.load(source)
+        source.close()
+    except Exception as e:
+        print(f"❌ Error loading tables: {e}")
+        sys.exit(1)
+
+    rec = builder.build(products_df, interactions)
+    artifact = save_model(rec, args.output)
+
+    report = builder.report(started, artifact)
+    for path in filter(
+        None, [os.path.join(artifact, "build_report.json"), args.report]
+    ):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for stage in report["stages"]:
+        status = "cached" if stage["cached"] else "built"
+        print(f"  {stage['stage']:<10} {status:<7} {stage['seconds']:>8.3f}s")
+    print(f"✅ Model written to {artifact} in {report['total_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Data sources for the recommendation engine.
+
+A data source provides load_products() and load_interactions(after=None)
+with the results of loaders.py: a compact products DataFrame and an
+InteractionBuffer. SqlSource reads a database through SQLAlchemy;
+ParquetSource reads a snapshot directory written by export_snapshot():
+
+    <snapshot>/products/*.parquet
+    <snapshot>/interactions/*.parquet
+    <snapshot>/snapshot.json
+
+Snapshots are read with pyarrow: only the columns the engine uses, from
+memory-mapped files, with row groups decoded on several threads. They let
+the API start on hosts without a database:
+
+    python data_sources.py export --output snapshot
+    MACROMED_DATA_SOURCE=snapshot python app.py
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow.fs import LocalFileSystem
+except ImportError:  # only needed for snapshots
+    pa = None
+
+from db import DATABASE_URL, get_engine, pool_stats
+from loaders import (
+    PRODUCT_COLUMNS,
+    compact_products,
+    interaction_columns,
+    load_interactions,
+    load_products,
+    stream_interactions,
+)
+from recommendations import WATERMARK_COLUMN, InteractionBuffer, interaction_watermark
+
+# Rows per Parquet row group (and per SQL fetch) when exporting
+EXPORT_CHUNK_ROWS = 1_000_000
+
+# Interaction rows decoded per batch when reading a snapshot
+SCAN_BATCH_ROWS = 1_000_000
+
+SNAPSHOT_MANIFEST = "snapshot.json"
+
+
+class SqlSource:
+    """Products and interactions tables behind a SQLAlchemy engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def load_products(self):
+        return load_products(self.engine)
+
+    def load_interactions(self, after=None):
+        return load_interactions(self.engine, after)
+
+    def describe(self):
+        return self.engine.url.render_as_string(hide_password=True)
+
+    def pool_stats(self):
+        return pool_stats(self.engine)
+
+    def close(self):
+        self.engine.dispose()
+
+
+class ParquetSource:
+    """Products and interactions from a Parquet snapshot directory"""
+
+    def __init__(self, path):
+        if pa is None:
+            raise ImportError("Parquet snapshots need pyarrow: pip install pyarrow")
+        self.path = path
+        self.filesystem = LocalFileSystem(use_mmap=True)
+
+    def _dataset(self, table):
+        return ds.dataset(
+            os.path.join(self.path, table), format="parquet", filesystem=self.filesystem
+        )
+
+    def load_products(self):
+        products = self._dataset("products").to_table(
+            columns=PRODUCT_COLUMNS, use_threads=True
+        )
+        return compact_products(products.to_pandas())
+
+    def load_interactions(self, after=None):
+        """Interactions (past the watermark after, if given), batch by batch"""
+        dataset = self._dataset("interactions")
+        scanner = dataset.scanner(
+            columns=interaction_columns(dataset.schema.names),
+            filter=None if after is None else ds.field(WATERMARK_COLUMN) > after,
+            batch_size=SCAN_BATCH_ROWS,
+            use_threads=True,
+        )
+        return InteractionBuffer.from_frames(
+            batch.to_pandas() for batch in scanner.to_batches()
+        )
+
+    def describe(self):
+        return f"parquet:{os.path.abspath(self.path)}"
+
+    def pool_stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def is_snapshot(spec):
+    return spec.startswith("parquet:") or os.path.isfile(
+        os.path.join(spec, SNAPSHOT_MANIFEST)
+    )
+
+
+def open_source(spec):
+    """Data source for a snapshot directory ("parquet:<dir>" or a directory
+    holding snapshot.json) or a database URL, served by the shared engine"""
+    if is_snapshot(spec):
+        return ParquetSource(spec.removeprefix("parquet:"))
+    return SqlSource(get_engine(spec))
+
+
+def export_snapshot(engine, path, chunksize=EXPORT_CHUNK_ROWS):
+    """Write the products and interactions tables as a Parquet snapshot.
+
+    The snapshot is staged next to path and moved into place when complete.
+    Returns the snapshot manifest.
+    """
+    if pa is None:
+        raise ImportError("Parquet snapshots need pyarrow: pip install pyarrow")
+    staging = path.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(os.path.join(staging, "products"))
+    os.makedirs(os.path.join(staging, "interactions"))
+
+    products_df = load_products(engine)
+    pq.write_table(
+        pa.Table.from_pandas(products_df, preserve_index=False),
+        os.path.join(staging, "products", "part-0.parquet"),
+    )
+
+    rows = 0
+    watermark = None
+    writer = None
+    try:
+        for chunk in stream_interactions(engine, chunksize=chunksize):
+            chunk["interaction_type"] = chunk["interaction_type"].astype(str)
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    os.path.join(staging, "interactions", "part-0.parquet"),
+                    table.schema,
+                    use_dictionary=["interaction_type"],
+                )
+            writer.write_table(table, row_group_size=chunksize)
+            rows += len(chunk)
+            high = interaction_watermark(chunk)
+            if high is not None:
+                watermark = high if watermark is None else max(watermark, high)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    manifest = {
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "products": len(products_df),
+        "interactions": rows,
+        "interaction_watermark": watermark,
+    }
+    with open(os.path.join(staging, SNAPSHOT_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(staging, path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="snapshot the database to Parquet")
+    export.add_argument("--database-url", default=DATABASE_URL)
+    export.add_argument("--output", default="snapshot")
+    args = parser.parse_args()
+
+    engine = get_engine(args.database_url)
+    try:
+        manifest = export_snapshot(engine, args.output)
+    except Exception as e:
+        print(f"❌ Error exporting snapshot: {e}")
+        sys.exit(1)
+    finally:
+        engine.dispose()
+    print(
+        f"✅ Snapshot of {manifest['products']} products and"
+        f" {manifest['interactions']} interactions written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Shared database engines for the API, the offline build and the tools.
+
+get_engine() returns one pooled SQLAlchemy engine per database URL for the
+whole process, so startup checks, model refreshes and any write-back path
+reuse open connections instead of paying connection setup each time. Pool
+settings come from MACROMED_DB_* environment variables.
+"""
+
+import os
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+# PostgreSQL DB credentials
+host = "localhost"
+port = 5432
+user = "postgres"
+password = "1234"
+database = "Macromed"
+
+DATABASE_URL = os.environ.get(
+    "MACROMED_DATABASE_URL",
+    f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}",
+)
+
+# Connections kept open, and extra ones allowed under load
+pool_size = int(os.environ.get("MACROMED_DB_POOL_SIZE", "5"))
+max_overflow = int(os.environ.get("MACROMED_DB_MAX_OVERFLOW", "10"))
+
+# Seconds to wait for a free connection
+pool_timeout = float(os.environ.get("MACROMED_DB_POOL_TIMEOUT", "30"))
+
+# Connections older than this many seconds are replaced (-1 = never), so
+# server-side idle timeouts never hand out a dead connection
+pool_recycle = int(os.environ.get("MACROMED_DB_POOL_RECYCLE", "1800"))
+
+# Test each connection with a cheap round trip when it is checked out
+pool_pre_ping = os.environ.get("MACROMED_DB_POOL_PRE_PING", "1") == "1"
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def _pool_options(url):
+    options = {"pool_pre_ping": pool_pre_ping, "pool_recycle": pool_recycle}
+    # In-memory SQLite keeps one connection per thread; no pool to size
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout
+    )
+    return options
+
+
+def get_engine(url=None):
+    """The process-wide pooled engine for url (DATABASE_URL by default)"""
+    url = make_url(url or DATABASE_URL)
+    key = url.render_as_string(hide_password=False)
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = create_engine(url, **_pool_options(url))
+        return engine
+
+
+def streaming_connection(engine):
+    """Connection whose queries use a server-side cursor, so large results
+    are fetched as they are consumed instead of all at once"""
+    return engine.connect().execution_options(stream_results=True)
+
+
+def pool_stats(engine):
+    """Connection pool counters, for pools that keep them"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+
+
+def dispose_engines(close=True):
+    """Drop every pooled connection, e.g. at shutdown.
+
+    A forked child passes close=False: the connections it inherited belong
+    to the parent and must be forgotten, not closed.
+    """
+    with _lock:
+        engines = list(_engines.values())
+        if close:
+            _engines.clear()
+    for engine in engines:
+        engine.dispose(close=close)
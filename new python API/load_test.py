@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Request-log replay load tester for the Python Recommendation API.
+
+Needs no PostgreSQL: a SQLite database with the same products/interactions
+schema stands in for Macromed, filled with synthetic data (see benchmark.py).
+
+    python load_test.py standin loadtest.db --products 20000 --events 500000
+    python load_test.py make-log loadtest.db requests.jsonl --requests 50000
+    python load_test.py replay requests.jsonl --db loadtest.db --rps 200
+
+Each log line is one /api/recommend request in the batch entry format,
+e.g. {"type": "price", "product_id": 12, "same_category": true}. Replay is
+open-loop: request i is due at start + i / rps whatever happened to earlier
+ones, and its latency is counted from that due time, so a server that falls
+behind shows up as queueing delay instead of a lower request rate. With
+--db the API is started against the stand-in database for the run;
+otherwise --url points at an API that is already running.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from benchmark import EVENTS_PER_USER, ZipfSampler, interaction_chunks, make_products
+from loaders import PRODUCT_COLUMNS
+from recommendations import RECOMMENDATION_TYPES
+
+PRODUCTS_TABLE = """
+CREATE TABLE products (
+    product_id INTEGER PRIMARY KEY,
+    product_name TEXT,
+    description TEXT,
+    category TEXT,
+    subcategory TEXT,
+    brand TEXT,
+    material TEXT,
+    price REAL,
+    image_url TEXT,
+    product_url TEXT
+)
+"""
+
+INTERACTIONS_TABLE = """
+CREATE TABLE interactions (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    interaction_type TEXT NOT NULL
+)
+"""
+
+# Default share of each recommendation type in a generated log
+REQUEST_MIX = {"content": 0.5, "price": 0.2, "cf": 0.15, "personalized": 0.15}
+
+# Share of generated price requests restricted to the same category
+SAME_CATEGORY_SHARE = 0.3
+
+# Seconds to wait for a server started with --db to answer /api/health
+STARTUP_TIMEOUT = 600
+
+
+def make_standin(path, products, events, seed=42):
+    """SQLite database with synthetic products and interactions tables"""
+    if os.path.exists(path):
+        os.remove(path)
+    rng = np.random.default_rng(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text(PRODUCTS_TABLE))
+        connection.execute(text(INTERACTIONS_TABLE))
+
+    products_df = make_products(rng, products)
+    with engine.begin() as connection:
+        products_df[PRODUCT_COLUMNS].to_sql(
+            "products", connection, if_exists="append", index=False
+        )
+        users = max(100, events // EVENTS_PER_USER)
+        for chunk in interaction_chunks(
+            rng, products_df["product_id"].to_numpy(), users, events
+        ):
+            chunk.to_sql("interactions", connection, if_exists="append", index=False)
+    engine.dispose()
+
+
+def make_log(database_url, path, requests, mix=REQUEST_MIX, seed=42):
+    """Write a JSONL request log; ids follow their popularity in interactions"""
+    rng = np.random.default_rng(seed)
+    engine = create_engine(database_url)
+    products = pd.read_sql("SELECT product_id FROM products", engine)["product_id"]
+    users = pd.read_sql(
+        "SELECT user_id, COUNT(*) AS n FROM interactions GROUP BY user_id "
+        "ORDER BY n DESC",
+        engine,
+    )["user_id"]
+    popular = pd.read_sql(
+        "SELECT product_id, COUNT(*) AS n FROM interactions GROUP BY product_id "
+        "ORDER BY n DESC",
+        engine,
+    )["product_id"]
+    engine.dispose()
+
+    # Popular products first, then the ones nobody interacted with
+    products = pd.concat([popular, products[~products.isin(popular)]]).to_numpy()
+    product_ranks = ZipfSampler(len(products), 1.0)
+    user_ranks = ZipfSampler(max(len(users), 1), 0.8)
+
+    types = np.array(list(mix))
+    shares = np.array(list(mix.values()), dtype=np.float64)
+    chosen = rng.choice(types, requests, p=shares / shares.sum())
+    product_ids = products[product_ranks(rng, requests)]
+    user_ids = users.to_numpy()[user_ranks(rng, requests)] if len(users) else None
+    same_category = rng.random(requests) < SAME_CATEGORY_SHARE
+
+    with open(path, "w") as f:
+        for i, rec_type in enumerate(chosen):
+            if rec_type in ("cf", "personalized"):
+                entry = {"type": rec_type, "user_id": int(user_ids[i])}
+            else:
+                entry = {"type": rec_type, "product_id": int(product_ids[i])}
+                if rec_type == "price" and same_category[i]:
+                    entry["same_category"] = True
+            f.write(json.dumps(entry) + "\n")
+
+
+def read_log(path):
+    """(type, query string) per logged request"""
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            rec_type = entry.get("type", "content")
+            id_field = "user_id" if rec_type in ("cf", "personalized") else "product_id"
+            query = {"type": rec_type, id_field: entry.get(id_field, "")}
+            if entry.get("same_category"):
+                query["same_category"] = "true"
+            requests.append((rec_type, urlencode(query)))
+    return requests
+
+
+class Client:
+    """Keep-alive HTTP connection of one replay thread"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.connection = None
+
+    def get(self, path):
+        # A dropped keep-alive connection is retried once on a new one
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout
+                )
+            try:
+                self.connection.request("GET", self.prefix + path)
+                response = self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+def replay(url, requests, rps, duration=None, threads=64, timeout=30):
+    """Send requests at rps (cycling through them for duration seconds)
+
+    Returns one (type, status or None on failure, latency s, service s)
+    tuple per request sent.
+    """
+    total = int(duration * rps) if duration else len(requests)
+    results = []
+    lock = threading.Lock()
+    next_index = iter(range(total))
+    started = time.perf_counter() + 0.1
+
+    def worker():
+        client = Client(url, timeout)
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                return
+
+            due = started + index / rps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            rec_type, query = requests[index % len(requests)]
+            sent = time.perf_counter()
+            try:
+                status = client.get(f"/api/recommend?{query}")
+            except (http.client.HTTPException, OSError):
+                status = None
+            finished = time.perf_counter()
+            with lock:
+                results.append((rec_type, status, finished - due, finished - sent))
+
+    pool = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    """Throughput, latency percentiles and error rates of a replay"""
+
+    def latency(rows):
+        latencies = np.array([row[2] for row in rows]) * 1000
+        service = np.array([row[3] for row in rows]) * 1000
+        return {
+            "requests": len(rows),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p90_ms": round(float(np.percentile(latencies, 90)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "max_ms": round(float(latencies.max()), 3),
+            "service_p50_ms": round(float(np.percentile(service, 50)), 3),
+            "service_p99_ms": round(float(np.percentile(service, 99)), 3),
+        }
+
+    statuses = Counter("failed" if row[1] is None else str(row[1]) for row in results)
+    # 404s are answers about unknown ids; failures and 5xx (503 busy) are errors
+    errors = sum(row[1] is None or row[1] >= 500 for row in results)
+    by_type = {}
+    for row in results:
+        by_type.setdefault(row[0], []).append(row)
+
+    return {
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 1) if elapsed else None,
+        "error_rate": round(errors / len(results), 5) if results else None,
+        "statuses": dict(sorted(statuses.items())),
+        "latency": latency(results) if results else None,
+        "by_type": {
+            rec_type: latency(rows) for rec_type, rows in sorted(by_type.items())
+        },
+    }
+
+
+def wait_for_health(url, server, timeout=STARTUP_TIMEOUT):
+    client = Client(url, timeout=5)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"API exited with code {server.returncode}")
+        try:
+            if client.get("/api/health") == 200:
+                return
+        except (http.client.HTTPException, OSError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("API did not become healthy in time")
+
+
+def start_server(db, port, server_mode):
+    """Start the API on the stand-in database in a child process"""
+    env = dict(
+        os.environ,
+        MACROMED_DATABASE_URL=f"sqlite:///{os.path.abspath(db)}",
+        # Build from the stand-in, never from a published artifact
+        MACROMED_MODEL_DIR=os.path.join(os.path.dirname(os.path.abspath(db)), ".none"),
+        MACROMED_PORT=str(port),
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    if server_mode == "asgi":
+        command = [sys.executable, os.path.join(here, "asgi.py")]
+    else:
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "serve",
+            "--port",
+            str(port),
+        ]
+    return subprocess.Popen(command, cwd=here, env=env)
+
+
+def serve(port):
+    # Flask's threaded development server, without debug reloading or a
+    # log line per request
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        rec_type, _, share = part.partition("=")
+        if rec_type not in RECOMMENDATION_TYPES:
+            raise argparse.ArgumentTypeError(f"unknown type {rec_type!r}")
+        mix[rec_type] = float(share)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    standin = commands.add_parser("standin", help="create the SQLite stand-in")
+    standin.add_argument("db")
+    standin.add_argument("--products", type=int, default=20_000)
+    standin.add_argument("--events", type=int, default=500_000)
+    standin.add_argument("--seed", type=int, default=42)
+
+    log = commands.add_parser("make-log", help="generate a JSONL request log")
+    log.add_argument("db", help="SQLite file or SQLAlchemy URL to draw ids from")
+    log.add_argument("output")
+    log.add_argument("--requests", type=int, default=50_000)
+    log.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=REQUEST_MIX,
+        help="e.g. content=0.5,price=0.2,cf=0.15,personalized=0.15",
+    )
+    log.add_argument("--seed", type=int, default=42)
+
+    run = commands.add_parser("replay", help="replay a request log at a fixed rate")
+    run.add_argument("log")
+    run.add_argument("--rps", type=float, default=100)
+    run.add_argument("--duration", type=float, help="seconds; cycles the log")
+    run.add_argument("--threads", type=int, default=64, help="concurrent clients")
+    run.add_argument("--timeout", type=float, default=30)
+    target = run.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://127.0.0.1:5000")
+    target.add_argument("--db", help="start the API on this stand-in for the run")
+    run.add_argument("--port", type=int, default=5055, help="port used with --db")
+    run.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    run.add_argument("--report", help="also write the JSON report here")
+
+    serve_parser = commands.add_parser("serve", help=argparse.SUPPRESS)
+    serve_parser.add_argument("--port", type=int, default=5000)
+
+    args = parser.parse_args()
+
+    if args.command == "standin":
+        make_standin(args.db, args.products, args.events, args.seed)
+        print(f"✅ Stand-in database written to {args.db}")
+    elif args.command == "make-log":
+        url = args.db if "://" in args.db else f"sqlite:///{args.db}"
+        make_log(url, args.output, args.requests, args.mix, args.seed)
+        print(f"✅ {args.requests} requests written to {args.output}")
+    elif args.command == "serve":
+        serve(args.port)
+    else:
+        requests = read_log(args.log)
+        if not requests:
+            parser.error(f"no requests in {args.log}")
+
+        server = None
+        url = args.url
+        if args.db:
+            url = f"http://127.0.0.1:{args.port}"
+            server = start_server(args.db, args.port, args.server)
+        try:
+            if server:
+                wait_for_health(url, server)
+            started = datetime.now(timezone.utc)
+            results, elapsed = replay(
+                url, requests, args.rps, args.duration, args.threads, args.timeout
+            )
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+        report = {
+            "started_at": started.isoformat(),
+            "url": url,
+            "log": args.log,
+            "target_rps": args.rps,
+            "threads": args.threads,
+            **summarize(results, elapsed),
+        }
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+
+        print(
+            f"  {len(results)} requests in {report['seconds']}s:"
+            f" {report['throughput_rps']} req/s (target {args.rps}),"
+            f" error rate {report['error_rate']:.2%}"
+        )
+        print(f"  statuses {report['statuses']}")
+        for name, stats in [("all", report["latency"]), *report["by_type"].items()]:
+            print(
+                f"  {name:<13} p50 {stats['p50_ms']:>9.3f} ms"
+                f"  p90 {stats['p90_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Database loaders for the recommendation engine.
+
+Products are loaded with only the columns the engine uses, in compact
+dtypes: attribute columns as pandas categories, prices as float32 and ids
+as int32. Interactions, likewise projected, are streamed in chunks through
+a server-side cursor into an InteractionBuffer, so the whole table is never
+held as a DataFrame.
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from db import streaming_connection
+from recommendations import (
+    ATTRIBUTE_COLUMNS,
+    HASHED_COLUMNS,
+    WATERMARK_COLUMN,
+    InteractionBuffer,
+)
+
+# Everything the engine reads from the products table
+PRODUCT_COLUMNS = HASHED_COLUMNS
+
+# Everything the engine reads from the interactions table; the watermark
+# column is optional and only needed for delta ingest
+INTERACTION_COLUMNS = [WATERMARK_COLUMN, "user_id", "product_id", "interaction_type"]
+
+# Interaction rows fetched from the cursor per chunk
+INTERACTION_CHUNK_ROWS = 50_000
+
+
+def compact_products(products_df):
+    """Project products_df to PRODUCT_COLUMNS with compact dtypes"""
+    products_df = products_df[PRODUCT_COLUMNS].copy()
+    products_df["product_id"] = products_df["product_id"].astype(np.int32)
+    products_df["price"] = pd.to_numeric(products_df["price"], errors="coerce").astype(
+        np.float32
+    )
+    for column in ATTRIBUTE_COLUMNS:
+        products_df[column] = (
+            products_df[column].fillna("").astype(str).astype("category")
+        )
+    return products_df
+
+
+def load_products(engine):
+    """Read the products table, selecting only the columns the engine needs"""
+    query = f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM products"
+    return compact_products(pd.read_sql(query, engine))
+
+
+def interaction_columns(available):
+    """INTERACTION_COLUMNS present in available, the watermark being optional"""
+    return [
+        column
+        for column in INTERACTION_COLUMNS
+        if column != WATERMARK_COLUMN or column in available
+    ]
+
+
+def stream_interactions(engine, after=None, chunksize=INTERACTION_CHUNK_ROWS):
+    """Yield interactions (past the watermark after, if given) in chunks"""
+    if after is None:
+        available = {c["name"] for c in inspect(engine).get_columns("interactions")}
+        columns = interaction_columns(available)
+    else:
+        # Only a table with the watermark column ever yields one to pass
+        columns = INTERACTION_COLUMNS
+    query = f"SELECT {', '.join(columns)} FROM interactions"
+    params = None
+    if after is not None:
+        query += f" WHERE {WATERMARK_COLUMN} > :watermark"
+        params = {"watermark": after}
+
+    # A server-side cursor, so rows arrive chunk by chunk instead of as one
+    # client-side result set
+    with streaming_connection(engine) as connection:
+        yield from pd.read_sql(
+            text(query), connection, params=params, chunksize=chunksize
+        )
+
+
+def load_interactions(engine, after=None):
+    """Stream interactions into an InteractionBuffer"""
+    return InteractionBuffer.from_frames(stream_interactions(engine, after))
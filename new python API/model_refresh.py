@@ -0,0 +1,117 @@
+"""
+Background model refresh with an atomic swap.
+
+Request handlers read the live model through ModelRefresher.current() once
+per request. A refresh builds a complete new engine on the side and then
+publishes it with a single reference assignment, so requests that already
+hold the previous model finish on it untouched.
+"""
+
+import contextlib
+import logging
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ModelState:
+    """An immutable snapshot of the serving model and how it was built"""
+
+    __slots__ = ("model", "generation", "built_at", "build_seconds", "source")
+
+    def __init__(self, model, generation, built_at, build_seconds, source):
+        self.model = model
+        self.generation = generation
+        self.built_at = built_at
+        self.build_seconds = build_seconds
+        self.source = source
+
+
+class ModelRefresher:
+    """Rebuilds the model on a schedule or on request and swaps it in
+
+    build(current_state) returns (model, source) for a new model, or None
+    when nothing changed since current_state (e.g. same artifact version).
+    """
+
+    def __init__(self, build, interval=0):
+        self._build = build
+        self.interval = interval
+        self._state = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def current(self):
+        return self._state
+
+    def refresh(self):
+        # One build at a time; concurrent callers wait and then see the result
+        with self._lock:
+            started = time.perf_counter()
+            result = self._build(self._state)
+            if result is None:
+                return False
+
+            model, source = result
+            generation = self._state.generation + 1 if self._state else 1
+            self._state = ModelState(
+                model,
+                generation,
+                datetime.now(timezone.utc),
+                round(time.perf_counter() - started, 3),
+                source,
+            )
+            state = self._state
+
+        # Logged outside the lock, which prefork.py holds across fork()
+        logger.info(
+            "Model generation %d ready from %s in %.3fs",
+            state.generation,
+            state.source,
+            state.build_seconds,
+        )
+        return True
+
+    @contextlib.contextmanager
+    def paused(self):
+        """Hold off refreshes (waiting out one in progress) for the block"""
+        with self._lock:
+            yield
+
+    def request_refresh(self):
+        self._wake.set()
+
+    def start(self):
+        """Run the background loop; the first model must already be built"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="model-refresher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGHUP", None)):
+        # Signal handlers can only be installed from the main thread
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signum, lambda *_: self.request_refresh())
+        return True
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval or None)
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Model refresh failed; keeping the current model")
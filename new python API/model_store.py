@@ -0,0 +1,275 @@
+"""
+On-disk model artifacts for the recommendation engine.
+
+An artifact is a directory of .npy arrays described by manifest.json.
+Versions live side by side under one root directory and the CURRENT file
+names the active one, so a new build can be published while running
+workers keep mapping the previous version.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from recommendations import ATTRIBUTE_COLUMNS, TFIDF_PARAMS, Recommendations
+
+FORMAT_VERSION = 3
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+# Published versions kept under a root; older ones are removed on save
+VERSIONS_KEEP = 3
+
+# Engine arrays stored under their attribute name
+PRODUCT_ARRAYS = [
+    "neighbor_indices",
+    "neighbor_scores",
+    "prices",
+    "price_order",
+    "price_sorted",
+    "category_price_order",
+    "category_price_sorted",
+    "category_price_offsets",
+]
+USER_ARRAYS = ["user_ids", "user_neighbor_indices", "user_neighbor_scores"]
+
+# Free-text product fields needed to render results
+STRING_COLUMNS = ["product_name", "image_url", "product_url"]
+
+
+class ArrayWriter:
+    """Writes named arrays, string columns and sparse matrices as .npy files"""
+
+    def __init__(self, path):
+        self.path = path
+        self.arrays = {}
+
+    def array(self, name, values):
+        values = np.ascontiguousarray(values)
+        np.save(os.path.join(self.path, name + ".npy"), values, allow_pickle=False)
+        self.arrays[name] = {"dtype": values.dtype.str, "shape": list(values.shape)}
+
+    def strings(self, name, values):
+        # UTF-8 blob plus byte offsets, which unlike object arrays can be mapped
+        encoded = [str(value).encode("utf-8") for value in values]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64)
+        self.array(name + ".offsets", np.concatenate([[0], np.cumsum(lengths)]))
+        self.array(name + ".blob", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def matrix(self, name, matrix):
+        self.array(name + ".data", matrix.data)
+        self.array(name + ".indices", matrix.indices)
+        self.array(name + ".indptr", matrix.indptr)
+        self.arrays[name + ".data"]["matrix_shape"] = list(matrix.shape)
+
+
+class ArrayReader:
+    """Reads back what ArrayWriter wrote, given its recorded array table"""
+
+    def __init__(self, path, arrays, mmap=True):
+        self.path = path
+        self.arrays = arrays
+        self.mmap_mode = "r" if mmap else None
+
+    def array(self, name):
+        # Empty arrays cannot be memory-mapped
+        mode = self.mmap_mode if np.prod(self.arrays[name]["shape"]) else None
+        return np.load(
+            os.path.join(self.path, name + ".npy"), mmap_mode=mode, allow_pickle=False
+        )
+
+    def strings(self, name):
+        offsets = self.array(name + ".offsets")
+        blob = self.array(name + ".blob")
+        return [
+            blob[start:stop].tobytes().decode("utf-8")
+            for start, stop in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def matrix(self, name, kind=sparse.csr_matrix):
+        shape = self.arrays[name + ".data"]["matrix_shape"]
+        return kind(
+            (
+                self.array(name + ".data"),
+                self.array(name + ".indices"),
+                self.array(name + ".indptr"),
+            ),
+            shape=tuple(shape),
+        )
+
+
+def make_vectorizer(vocabulary, idf):
+    """Rebuild a fitted TfidfVectorizer from its vocabulary and idf weights"""
+    vectorizer = TfidfVectorizer(**TFIDF_PARAMS)
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(vocabulary)}
+    vectorizer.idf_ = np.asarray(idf)
+    return vectorizer
+
+
+def current_version_path(root):
+    """Return the directory of the active artifact under root, or None"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, version)
+
+
+def save_model(rec, root, version=None):
+    """Write rec as a new artifact version under root and make it current"""
+    if version is None:
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+    target = os.path.join(root, version)
+    staging = target + ".tmp"
+    os.makedirs(staging)
+    writer = ArrayWriter(staging)
+
+    # TF-IDF output is already L2-normalised, so one matrix serves both roles
+    writer.strings("vocabulary", rec.tfidf.get_feature_names_out())
+    writer.array("idf", rec.tfidf.idf_)
+    writer.matrix("unit_matrix", rec._unit_matrix)
+
+    for name in PRODUCT_ARRAYS:
+        writer.array(name, getattr(rec, name))
+
+    # Compact product metadata: ids, rendered text fields and attribute codes
+    writer.array("product_ids", rec.products_df["product_id"].to_numpy())
+    writer.array("product_hashes", rec.product_hashes)
+    for column in STRING_COLUMNS:
+        writer.strings("products." + column, rec.products_df[column])
+    writer.strings("fragments", rec.fragments)
+    for column in ATTRIBUTE_COLUMNS:
+        writer.array("codes." + column, rec.attribute_codes[column])
+        writer.strings("values." + column, rec.attribute_values[column])
+        writer.array("postings." + column + ".rows", rec.posting_rows[column])
+        writer.array("postings." + column + ".offsets", rec.posting_offsets[column])
+
+    has_user_cf = rec.user_item_matrix is not None
+    if has_user_cf:
+        writer.matrix("user_item", rec.user_item_matrix)
+        writer.matrix("item_user", rec.item_user_matrix)
+        for name in USER_ARRAYS:
+            writer.array(name, getattr(rec, name))
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "neighbor_k": rec.neighbor_k,
+        "indexed_terms": rec.indexed_terms,
+        "oov_terms": rec.oov_terms,
+        "needs_refit": rec.needs_refit,
+        "n_products": len(rec.products_df),
+        "n_users": len(rec.user_ids) if has_user_cf else 0,
+        "n_interactions": rec.interaction_count,
+        "interaction_watermark": rec.interaction_watermark,
+        "has_user_cf": has_user_cf,
+        "arrays": writer.arrays,
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    os.rename(staging, target)
+
+    # Publish atomically; readers see either the old or the new version
+    pointer = os.path.join(root, CURRENT_FILE)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+    _prune_versions(root, version)
+    return target
+
+
+def _prune_versions(root, current):
+    """Remove all but the VERSIONS_KEEP newest versions, never current.
+
+    Workers still mapping a removed version keep their pages until they
+    unmap them; only new loads need the version on disk.
+    """
+    entries = sorted(
+        (
+            os.path.join(root, name)
+            for name in os.listdir(root)
+            if name != current
+            and not name.endswith(".tmp")
+            and os.path.isfile(os.path.join(root, name, MANIFEST_FILE))
+        ),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for stale in entries[VERSIONS_KEEP - 1 :]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def load_model(path, mmap=True):
+    """Open an artifact (a version directory or a root with CURRENT)
+
+    Arrays are memory-mapped read-only by default, so every process that
+    opens the same version shares one copy in the page cache.
+    """
+    version_path = current_version_path(path) or path
+    with open(os.path.join(version_path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported model format {manifest['format_version']} "
+            f"(expected {FORMAT_VERSION})"
+        )
+
+    reader = ArrayReader(version_path, manifest["arrays"], mmap)
+    rec = Recommendations.__new__(Recommendations)
+    rec.manifest = manifest
+
+    rec.tfidf = make_vectorizer(reader.strings("vocabulary"), reader.array("idf"))
+    rec._unit_matrix = reader.matrix("unit_matrix")
+    rec.tfidf_matrix = rec._unit_matrix
+    rec.indexed_terms = manifest["indexed_terms"]
+    rec.oov_terms = manifest["oov_terms"]
+    rec.needs_refit = manifest["needs_refit"]
+
+    rec.neighbor_k = manifest["neighbor_k"]
+    for name in PRODUCT_ARRAYS:
+        setattr(rec, name, reader.array(name))
+    rec._build_item_neighbor_matrix()
+
+    rec.attribute_codes = {}
+    rec.attribute_values = {}
+    rec.posting_rows = {}
+    rec.posting_offsets = {}
+    for column in ATTRIBUTE_COLUMNS:
+        rec.attribute_codes[column] = reader.array("codes." + column)
+        rec.attribute_values[column] = pd.Index(reader.strings("values." + column))
+        rec.posting_rows[column] = reader.array("postings." + column + ".rows")
+        rec.posting_offsets[column] = reader.array("postings." + column + ".offsets")
+
+    products = {"product_id": reader.array("product_ids")}
+    for column in STRING_COLUMNS:
+        products[column] = reader.strings("products." + column)
+    for column in ATTRIBUTE_COLUMNS:
+        products[column] = pd.Categorical.from_codes(
+            rec.attribute_codes[column], categories=rec.attribute_values[column]
+        )
+    products["price"] = rec.prices.astype(np.float32)
+    rec._set_products(pd.DataFrame(products), reader.array("product_hashes"))
+    rec.fragments = reader.strings("fragments")
+
+    rec.interaction_count = manifest["n_interactions"]
+    rec.interaction_watermark = manifest.get("interaction_watermark")
+    if manifest["has_user_cf"]:
+        rec.user_item_matrix = reader.matrix("user_item")
+        rec.item_user_matrix = reader.matrix("item_user", sparse.csc_matrix)
+        for name in USER_ARRAYS:
+            setattr(rec, name, reader.array(name))
+        rec.user_indices = pd.Series(np.arange(len(rec.user_ids)), index=rec.user_ids)
+    else:
+        rec.user_item_matrix = None
+
+    return rec
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Multi-worker launcher for the Python Recommendation API (Unix only).
+
+    python prefork.py --workers 8 --port 5000
+
+The master process imports app.py, which builds the model or memory-maps
+the published artifact, warms it up and then forks the workers. Workers
+share the model's pages with the master copy-on-write, so N workers do not
+hold N copies of the TF-IDF and neighbor matrices. Each worker serves the
+shared listening socket with a threaded WSGI server.
+
+Model refreshes (MACROMED_REFRESH_SECONDS, SIGHUP) run in the master only,
+and never while it forks. When one produces a new model generation, the
+master warms it up and replaces the workers: new ones are forked first,
+then the old ones are stopped gracefully. SIGTERM or SIGINT stops the
+workers gracefully and then the master. A worker that dies is replaced.
+/api/metrics counters are per worker.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger("macromed.prefork")
+
+# Worker processes (default: one per core)
+worker_count = int(os.environ.get("MACROMED_WORKERS", str(os.cpu_count() or 1)))
+
+# Recommendation calls made per type on each new model before forking
+warmup_requests = int(os.environ.get("MACROMED_WARMUP_REQUESTS", "200"))
+
+# Seconds a stopping worker gets to finish its requests before SIGKILL
+graceful_timeout = float(os.environ.get("MACROMED_GRACEFUL_TIMEOUT", "30"))
+
+# Pending connections queued on the shared listening socket
+listen_backlog = 1024
+
+
+def warmup(model, requests):
+    """Run requests recommendations of each type through a new model.
+
+    Exercises every scoring path and faults in the model's pages before the
+    fork, so workers start hot and share those pages.
+    """
+    started = time.perf_counter()
+    product_ids = model.products_df["product_id"].to_numpy()
+    user_ids = getattr(model, "user_ids", None)
+    step = max(len(product_ids) // max(requests, 1), 1)
+    for rec_type in ("content", "price", "cf", "personalized"):
+        ids = user_ids if rec_type in ("cf", "personalized") else product_ids
+        if ids is None or not len(ids):
+            continue
+        for entry_id in ids[::step][:requests]:
+            rows = model.get_recommendation_rows(rec_type, [int(entry_id)])[0]
+            if not isinstance(rows, str):
+                model.render_json(rows)
+    return time.perf_counter() - started
+
+
+def run_worker(api, listener):
+    """Serve the shared socket until SIGTERM; runs in a forked child"""
+    from db import dispose_engines
+
+    # Database connections and the refresh loop belong to the master
+    dispose_engines(close=False)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    server = make_server(
+        listener.getsockname()[0],
+        listener.getsockname()[1],
+        api.app,
+        threaded=True,
+        fd=listener.fileno(),
+    )
+
+    def stop(*_):
+        # shutdown() waits for serve_forever(), so call it off this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+
+    # Let requests that were already accepted finish
+    deadline = time.monotonic() + graceful_timeout
+    while api.in_flight.value > 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    server.server_close()
+
+
+class Master:
+    """Forks workers for the current model and keeps them running"""
+
+    def __init__(self, api, listener, workers):
+        self.api = api
+        self.listener = listener
+        self.workers = workers
+        self.children = {}  # pid -> model generation it was forked with
+        self.stopping = False
+
+    def spawn(self, generation):
+        # Fork only between refreshes: a build in progress may hold locks
+        # (database pool, logging, BLAS threads) the child would inherit
+        # held and never see released
+        with self.api.refresher.paused():
+            pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.api, self.listener)
+            except BaseException:
+                logger.exception("Worker failed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = generation
+        return pid
+
+    def prepare(self, state):
+        elapsed = warmup(state.model, warmup_requests)
+        logger.info("Warmed up generation %d in %.3fs", state.generation, elapsed)
+        # Keep the garbage collector from touching, and so copying, every
+        # object the workers inherit
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    def roll(self, state):
+        """Replace every worker with one forked from state's model"""
+        self.prepare(state)
+        old = [
+            pid
+            for pid, generation in self.children.items()
+            if generation != state.generation
+        ]
+        for _ in range(self.workers):
+            self.spawn(state.generation)
+        for pid in old:
+            self._signal(pid, signal.SIGTERM)
+        logger.info(
+            "Generation %d now served by %d workers", state.generation, self.workers
+        )
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        """Forget exited workers; returns the generations they served"""
+        exited = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            generation = self.children.pop(pid, None)
+            if generation is not None:
+                exited.append((pid, generation, status))
+        return exited
+
+    def run(self):
+        def stop(*_):
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        state = self.api.refresher.current()
+        self.roll(state)
+
+        while not self.stopping:
+            time.sleep(0.2)
+            current = self.api.refresher.current()
+            if current.generation != state.generation:
+                state = current
+                self.roll(state)
+
+            for pid, generation, status in self._reap():
+                if generation == state.generation and not self.stopping:
+                    logger.warning(
+                        "Worker %d exited (code %d); replacing it",
+                        pid,
+                        os.waitstatus_to_exitcode(status),
+                    )
+                    self.spawn(state.generation)
+
+        self.shutdown()
+
+    def shutdown(self):
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGKILL)
+        while self._reap():
+            pass
+        self.api.refresher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=worker_count)
+    parser.add_argument("--host", default=os.environ.get("MACROMED_HOST", "127.0.0.1"))
+    parser.add_argument(
+        "--port", type=int, default=int(os.environ.get("MACROMED_PORT", "5000"))
+    )
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        print("❌ The multi-worker launcher needs a Unix system with fork()")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    # Bind before building the model, so a busy port fails fast
+    listener = socket.create_server(
+        (args.host, args.port), backlog=listen_backlog, reuse_port=False
+    )
+    listener.set_inheritable(True)
+
+    # Builds the first model (or maps the artifact) and starts the refresher
+    import app as api
+
+    logger.info(
+        "Serving on http://%s:%d with %d workers", args.host, args.port, args.workers
+    )
+    Master(api, listener, args.workers).run()
+    listener.close()
+
+
+if __name__ == "__main__":
+    main()
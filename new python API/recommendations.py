@@ -1,223 +1,964 @@
+import copy
+import json
+
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from sqlalchemy import create_engine
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+
+from stage_timing import stage
+
+# Vectorizer settings, shared with saved model artifacts
+TFIDF_PARAMS = {"stop_words": "english"}
+
+# Neighbors kept per product in the similarity table
+DEFAULT_NEIGHBOR_K = 100
+
+# Fields combined into the text used for TF-IDF similarity
+TEXT_COLUMNS = [
+    "product_name",
+    "description",
+    "category",
+    "subcategory",
+    "brand",
+    "material",
+]
+
+# Assign weights to interaction types
+INTERACTION_WEIGHTS = {
+    "purchase": 5,
+    "add_to_cart": 3,
+    "wishlist": 2,
+    "compare": 2,
+    "view": 1,
+    "search": 1,
+}
+
+# Product fields whose change requires re-indexing that product
+HASHED_COLUMNS = ["product_id", *TEXT_COLUMNS, "price", "image_url", "product_url"]
+
+# Share of out-of-vocabulary terms added by upserts after which the
+# TF-IDF vocabulary should be refitted from scratch
+MAX_VOCABULARY_DRIFT = 0.05
+
+# Monotonic interactions column (serial id or timestamp) used as the
+# watermark for incremental ingestion
+WATERMARK_COLUMN = "id"
+
+# Similar users aggregated for user-to-user recommendations
+USER_NEIGHBOR_K = 5
+
+# Attributes compared by integer code instead of per-row pandas lookups
+ATTRIBUTE_COLUMNS = ["category", "subcategory", "brand", "material"]
+
+# Content-based quotas: (attributes any of which must match, how many to take)
+QUOTAS = [
+    (("category", "subcategory"), 2),
+    (("brand",), 2),
+    (("material",), 1),
+]
+
+RECOMMENDATION_TYPES = ("content", "price", "cf", "personalized")
+
+# Public fields of a recommended product, in every response
+RESULT_COLUMNS = [
+    "product_id",
+    "product_name",
+    "category",
+    "brand",
+    "material",
+    "price",
+    "image_url",
+    "product_url",
+]
+
+# Free text only needed to fit features, dropped from products_df afterwards
+FEATURE_ONLY_COLUMNS = ["combined_text", "description"]
+
+# Similarity rows computed per block, sized as if the block were dense
+NEIGHBOR_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def _top_k_positions(values, k, keys=None):
+    """Positions of the k largest values, best first.
+
+    Ties are broken by ascending keys (default: position), which matches a
+    stable descending sort over all of values.
+    """
+    if keys is None:
+        keys = np.arange(len(values))
+    if k >= len(values):
+        return np.lexsort((keys, -values))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    top = np.argpartition(-values, k - 1)[:k]
+    kth = values[top].min()
+    # Only when argpartition left out some value tied with the k-th one do
+    # the ties need resolving toward the lowest keys
+    if np.count_nonzero(values == kth) > np.count_nonzero(values[top] == kth):
+        above = np.flatnonzero(values > kth)
+        tied = np.flatnonzero(values == kth)
+        tied = tied[np.argsort(keys[tied], kind="stable")]
+        top = np.concatenate([above, tied[: k - len(above)]])
+    return top[np.lexsort((keys[top], -values[top]))]
+
+
+def _top_k_sparse_row(cols, vals, k, n_cols, exclude):
+    """Top-k (columns, scores) of one sparse row as if it were dense.
+
+    Columns without a stored entry score 0, so a row with fewer than k
+    positive entries is filled with its lowest zero columns; exclude (the
+    row itself) is never returned. Ties go to the lower column.
+    """
+    keep = cols != exclude
+    cols, vals = cols[keep], vals[keep]
+    positive = vals > 0
+    if np.count_nonzero(positive) >= k:
+        cols, vals = cols[positive], vals[positive]
+        top = _top_k_positions(vals, k, cols)
+        return cols[top], vals[top]
+
+    top = _top_k_positions(vals[positive], k, cols[positive])
+    picked_cols = [cols[positive][top]]
+    picked_vals = [vals[positive][top]]
+    need = k - len(top)
+
+    # The lowest columns scoring 0: every column not holding a nonzero
+    nonzero = np.union1d(cols[vals != 0], [exclude])
+    zeros = np.setdiff1d(
+        np.arange(min(need + len(nonzero), n_cols)), nonzero, assume_unique=True
+    )[:need]
+    picked_cols.append(zeros)
+    picked_vals.append(np.zeros(len(zeros), dtype=vals.dtype))
+    need -= len(zeros)
+
+    if need > 0:
+        negative = vals < 0
+        top = _top_k_positions(vals[negative], need, cols[negative])
+        picked_cols.append(cols[negative][top])
+        picked_vals.append(vals[negative][top])
+    return np.concatenate(picked_cols), np.concatenate(picked_vals)
+
+
+def _neighbor_table(unit_matrix, k, rows=None):
+    """Top-k cosine neighbors of rows of an L2-normalised sparse matrix.
+
+    Similarities are computed one block of rows at a time and stay sparse;
+    each row is ranked from its own stored entries. A row is never its own
+    neighbor. rows limits the table to those rows (default: all of them).
+    """
+    n_rows = unit_matrix.shape[0]
+    rows = np.arange(n_rows) if rows is None else np.asarray(rows)
+    k = min(k, max(n_rows - 1, 0))
+    # CSR on both sides, so the product never converts the right operand
+    unit_t = unit_matrix.T.tocsr()
+    block = max(1, NEIGHBOR_BLOCK_BYTES // max(n_rows * 8, 1))
+
+    indices = np.empty((len(rows), k), dtype=np.int32)
+    scores = np.empty((len(rows), k), dtype=np.float32)
+    for start in range(0, len(rows), block):
+        chunk = rows[start : start + block]
+        sims = (unit_matrix[chunk] @ unit_t).tocsr()
+        for offset, row in enumerate(chunk):
+            begin, end = sims.indptr[offset], sims.indptr[offset + 1]
+            cols, vals = _top_k_sparse_row(
+                sims.indices[begin:end], sims.data[begin:end], k, n_rows, row
+            )
+            indices[start + offset] = cols
+            scores[start + offset] = vals
+
+    return indices, scores
+
+
+def _patch_neighbor_table(unit_matrix, indices, scores, changed):
+    """Update a neighbor table after the rows in changed were modified.
+
+    unit_matrix may have more rows than the table; those new rows must be
+    listed in changed. Changed rows are recomputed. Every other row is
+    merged from its old list and its new similarities to the changed rows,
+    and recomputed in full only when the merge cannot be proven exact.
+    Returns new arrays; the inputs are left untouched.
+    """
+    n_rows = unit_matrix.shape[0]
+    old_rows, k = indices.shape
+    changed = np.unique(changed)
+
+    new_indices = np.empty((n_rows, k), dtype=np.int32)
+    new_scores = np.empty((n_rows, k), dtype=np.float32)
+    new_indices[:old_rows] = indices
+    new_scores[:old_rows] = scores
+    if k == 0 or len(changed) == 0:
+        return new_indices, new_scores
+
+    # Sparse similarities of every row to the changed rows
+    to_changed = (unit_matrix @ unit_matrix[changed].T).tocsr()
+    best_new = to_changed.max(axis=1).toarray().ravel()[:old_rows]
+    kth = scores[:, -1]
+
+    # Rows whose list held a changed row, or that a changed row now enters
+    is_changed = np.zeros(n_rows, dtype=bool)
+    is_changed[changed] = True
+    touched = np.isin(indices, changed).any(axis=1) | (best_new > kth)
+    touched &= ~is_changed[:old_rows]
+
+    recompute = [changed]
+    for row in np.flatnonzero(touched):
+        keep = ~is_changed[indices[row]]
+        start, stop = to_changed.indptr[row], to_changed.indptr[row + 1]
+        candidates = np.concatenate(
+            [indices[row][keep], changed[to_changed.indices[start:stop]]]
+        )
+        candidate_scores = np.concatenate(
+            [scores[row][keep], to_changed.data[start:stop]]
+        )
+        order = np.lexsort((candidates, -candidate_scores))[:k]
+
+        # Rows outside the old list score at most the old k-th score, so
+        # the merge is exact only if its k-th entry beats that strictly
+        if len(order) < k or candidate_scores[order[-1]] <= kth[row]:
+            recompute.append([row])
+            continue
+        new_indices[row] = candidates[order]
+        new_scores[row] = candidate_scores[order]
+
+    recompute = np.concatenate(recompute)
+    new_indices[recompute], new_scores[recompute] = _neighbor_table(
+        unit_matrix, k, rows=recompute
+    )
+    return new_indices, new_scores
+
+
+def _top_k_sparse_rows(matrix, k):
+    """Columns of the k best stored entries in each CSR row, best first.
+
+    Each row is ranked from its own stored entries, so the cost follows the
+    row's length rather than the longest row in the batch; ties go to the
+    lower column.
+    """
+    matrix = matrix.tocsr()
+    matrix.sum_duplicates()
+    ranked = []
+    for row in range(matrix.shape[0]):
+        begin, end = matrix.indptr[row], matrix.indptr[row + 1]
+        top = _top_k_positions(matrix.data[begin:end], k)
+        ranked.append(matrix.indices[begin:end][top])
+    return ranked
+
+
+def _unseen_scores(scores, seen):
+    # Positive entries of scores at products the matching row of seen lacks
+    scores = (scores - scores.multiply(seen != 0)).tocsr()
+    scores.data[scores.data < 0] = 0
+    scores.eliminate_zeros()
+    return scores
+
+
+def interaction_watermark(interactions_df):
+    """Highest WATERMARK_COLUMN value seen, or None if the column is absent"""
+    if WATERMARK_COLUMN not in interactions_df or interactions_df.empty:
+        return None
+    watermark = interactions_df[WATERMARK_COLUMN].max()
+    return watermark.item() if isinstance(watermark, np.generic) else watermark
+
+
+# Weight per interaction type code; unknown types (code -1) get the trailing 0
+_WEIGHT_LOOKUP = np.array([*INTERACTION_WEIGHTS.values(), 0], dtype=np.float32)
+
+
+def _interaction_scores(interaction_types):
+    codes = pd.Categorical(interaction_types, categories=list(INTERACTION_WEIGHTS))
+    return _WEIGHT_LOOKUP[codes.codes]
+
+
+class InteractionBuffer:
+    """Interaction weights accumulated chunk by chunk as COO buffers.
+
+    Only the user id, product id and weight of each interaction are kept,
+    so a table streamed in through add() never exists as one DataFrame.
+    """
+
+    def __init__(self):
+        self._users = []
+        self._products = []
+        self._scores = []
+        self.count = 0
+        self.watermark = None
+
+    @classmethod
+    def from_frames(cls, interactions):
+        """Buffer a DataFrame or an iterable of DataFrame chunks"""
+        if isinstance(interactions, cls):
+            return interactions
+        if isinstance(interactions, pd.DataFrame):
+            interactions = [interactions]
+        buffer = cls()
+        for chunk in interactions:
+            buffer.add(chunk)
+        return buffer
+
+    def add(self, chunk):
+        self._users.append(chunk["user_id"].to_numpy())
+        self._products.append(chunk["product_id"].to_numpy())
+        self._scores.append(_interaction_scores(chunk["interaction_type"]))
+        self.count += len(chunk)
+
+        watermark = interaction_watermark(chunk)
+        if watermark is not None and (
+            self.watermark is None or watermark > self.watermark
+        ):
+            self.watermark = watermark
+
+    def arrays(self):
+        """(user ids, product ids, weights), one entry per interaction"""
+        if not self._users:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+        # Join the chunks once and keep the joined buffers
+        self._users = [np.concatenate(self._users)]
+        self._products = [np.concatenate(self._products)]
+        self._scores = [np.concatenate(self._scores)]
+        return self._users[0], self._products[0], self._scores[0]
+
+
+def fill_missing_text(products_df):
+    """Replace nulls with "" in place; compact float32 columns keep NaN"""
+    for column in products_df.columns:
+        values = products_df[column]
+        if values.dtype == np.float32 or not values.hasnans:
+            continue
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            if "" not in values.cat.categories:
+                values = values.cat.add_categories("")
+        products_df[column] = values.fillna("")
+
+
+def product_hashes(products_df):
+    """Per-row content hashes used to spot new or edited products"""
+    columns = products_df.reindex(columns=HASHED_COLUMNS).fillna("").astype(str)
+    return pd.util.hash_pandas_object(columns, index=False).to_numpy()
+
+
+def combine_text(products_df):
+    """Concatenate the descriptive product fields used for text similarity."""
+    text = products_df[TEXT_COLUMNS[0]].astype(str)
+    for column in TEXT_COLUMNS[1:]:
+        text = text + " " + products_df[column].astype(str)
+    return text
 
 
 class Recommendations:
-    def __init__(self, products_df, interactions_df=None):
+    # Set on engines whose upserts have drifted too far from the vocabulary
+    needs_refit = False
+
+    def __init__(
+        self, products_df, interactions_df=None, neighbor_k=DEFAULT_NEIGHBOR_K
+    ):
         # Clean nulls
-        products_df.fillna("", inplace=True)
+        fill_missing_text(products_df)
 
         # Combine fields for text similarity
-        products_df["combined_text"] = (
-            products_df["product_name"].astype(str)
-            + " "
-            + products_df["description"].astype(str)
-            + " "
-            + products_df["category"].astype(str)
-            + " "
-            + products_df["subcategory"].astype(str)
-            + " "
-            + products_df["brand"].astype(str)
-            + " "
-            + products_df["material"].astype(str)
-        )
-
-        self.products_df = products_df
-        self.product_indices = pd.Series(
-            products_df.index, index=products_df["product_id"]
-        )
+        products_df["combined_text"] = combine_text(products_df)
+        self._set_products(products_df)
 
         # TF-IDF product similarity
-        self.tfidf = TfidfVectorizer(stop_words="english")
-        self.tfidf_matrix = self.tfidf.fit_transform(products_df["combined_text"])
-        self.cosine_sim = cosine_similarity(self.tfidf_matrix, self.tfidf_matrix)
+        self._fit_tfidf(products_df["combined_text"])
+        self._drop_feature_text()
+
+        # Top-K neighbor table instead of the dense N x N similarity matrix.
+        # neighbor_k=None keeps the full ranking for every product.
+        self._build_neighbors(neighbor_k)
+        self._build_catalog_indexes()
+        self._build_fragments()
 
         # Prepare collaborative filtering data if provided
         if interactions_df is not None:
             self._prepare_user_cf(interactions_df)
         else:
-            self.user_cf_model = None
-
-    def _prepare_user_cf(self, interactions_df):
-        # Assign weights to interaction types
-        interaction_weights = {
-            "purchase": 5,
-            "add_to_cart": 3,
-            "wishlist": 2,
-            "compare": 2,
-            "view": 1,
-            "search": 1,
-        }
-
-        interactions_df["score"] = (
-            interactions_df["interaction_type"].map(interaction_weights).fillna(0)
-        )
+            self.user_item_matrix = None
+            self.interaction_count = 0
+            self.interaction_watermark = None
 
-        # Sum weights for each (user, product)
-        pivot = (
-            interactions_df.groupby(["user_id", "product_id"])["score"]
-            .sum()
-            .unstack(fill_value=0)
+    def _set_products(self, products_df, hashes=None):
+        self.products_df = products_df
+        self.product_indices = pd.Series(
+            products_df.index, index=products_df["product_id"]
         )
+        self.product_hashes = product_hashes(products_df) if hashes is None else hashes
 
-        self.user_item_matrix = pivot
-        self.user_ids = list(pivot.index)
-        self.product_ids = list(pivot.columns)
+    def _fit_tfidf(self, texts):
+        self.tfidf = TfidfVectorizer(**TFIDF_PARAMS)
+        self.tfidf_matrix = self.tfidf.fit_transform(texts)
+        self._unit_matrix = normalize(self.tfidf_matrix).tocsr()
 
-        # Fit k-NN model on user vectors
-        self.user_cf_model = NearestNeighbors(metric="cosine", algorithm="brute")
-        self.user_cf_model.fit(pivot)
+        # (document, term) pairs indexed vs. dropped as unknown since the fit
+        self.indexed_terms = int(self.tfidf_matrix.nnz)
+        self.oov_terms = 0
 
-    def get_user_to_user_recommendations(self, user_id, top_n=5):
-        if self.user_cf_model is None:
-            return "Collaborative filtering not initialized."
+    def _drop_feature_text(self):
+        self.products_df.drop(
+            columns=FEATURE_ONLY_COLUMNS, errors="ignore", inplace=True
+        )
 
-        if user_id not in self.user_item_matrix.index:
-            return f"User ID {user_id} not found in interaction data."
+    def matrix_stats(self):
+        """{name: (nnz, bytes)} of the main sparse matrices and tables"""
+        matrices = {
+            "unit_matrix": self._unit_matrix,
+            "item_neighbors": self.item_neighbor_matrix,
+        }
+        if self.user_item_matrix is not None:
+            matrices["user_item"] = self.user_item_matrix
+            matrices["item_user"] = self.item_user_matrix
+
+        stats = {
+            name: (
+                int(matrix.nnz),
+                matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes,
+            )
+            for name, matrix in matrices.items()
+        }
+        if self.user_item_matrix is not None:
+            stats["user_neighbors"] = (
+                int(self.user_neighbor_indices.size),
+                self.user_neighbor_indices.nbytes + self.user_neighbor_scores.nbytes,
+            )
+        return stats
+
+    @property
+    def vocabulary_drift(self):
+        return self.oov_terms / max(self.indexed_terms + self.oov_terms, 1)
+
+    def product_changes(self, products_df):
+        """Split a full product table into new/edited rows and removed ids"""
+        hashes = pd.Series(product_hashes(products_df), index=products_df.index)
+        rows = self.product_indices.index.get_indexer(products_df["product_id"])
+        known = rows >= 0
+        edited = known.copy()
+        edited[known] = hashes[known].to_numpy() != self.product_hashes[rows[known]]
+
+        removed = np.setdiff1d(
+            self.products_df["product_id"].to_numpy(),
+            products_df["product_id"].to_numpy(),
+        )
+        return products_df[edited | ~known], removed
+
+    def with_products(self, products_df, max_drift=MAX_VOCABULARY_DRIFT):
+        """Return a new engine with products_df upserted into the catalog.
+
+        New and edited products are transformed with the existing TF-IDF
+        vocabulary and their neighbors patched into the table; this engine
+        is left unchanged. needs_refit on the result turns True once the
+        share of unknown terms added this way passes max_drift.
+        """
+        products_df = products_df.drop_duplicates("product_id", keep="last").copy()
+        fill_missing_text(products_df)
+        texts = combine_text(products_df)
+
+        # Edited products keep their row; new ones are appended in order
+        n_old = len(self.products_df)
+        rows = self.product_indices.index.get_indexer(products_df["product_id"])
+        added = rows < 0
+        rows[added] = n_old + np.arange(added.sum())
+        source = np.arange(n_old + added.sum())
+        source[rows] = n_old + np.arange(len(products_df))
+
+        updated = copy.copy(self)
+        hashes = np.concatenate([self.product_hashes, product_hashes(products_df)])
+        frame = pd.concat(
+            [self.products_df, products_df.reindex(columns=self.products_df.columns)],
+            ignore_index=True,
+        )
+        for column in ATTRIBUTE_COLUMNS:
+            # Concatenating categoricals with different categories gives object
+            if isinstance(self.products_df[column].dtype, pd.CategoricalDtype):
+                frame[column] = frame[column].astype("category")
+        updated._set_products(frame.iloc[source].reset_index(drop=True), hashes[source])
+
+        # Transform with the fitted vocabulary and track what it cannot see
+        changed = self.tfidf.transform(texts)
+        analyzer = self.tfidf.build_analyzer()
+        vocabulary = self.tfidf.vocabulary_
+        unknown = sum(
+            len({t for t in analyzer(text) if t not in vocabulary}) for text in texts
+        )
+        updated.indexed_terms = self.indexed_terms + int(changed.nnz)
+        updated.oov_terms = self.oov_terms + unknown
+        updated.needs_refit = updated.vocabulary_drift > max_drift
+
+        unit_matrix = sparse.vstack(
+            [self._unit_matrix, normalize(changed)], format="csr"
+        )[source]
+        updated._unit_matrix = unit_matrix
+        updated.tfidf_matrix = unit_matrix
+
+        if self.neighbor_k >= n_old - 1:
+            # A full table stays full as the catalog grows
+            updated._build_neighbors(None)
+        else:
+            updated.neighbor_indices, updated.neighbor_scores = _patch_neighbor_table(
+                unit_matrix, self.neighbor_indices, self.neighbor_scores, rows
+            )
+            updated._build_item_neighbor_matrix()
+        updated._build_catalog_indexes()
+
+        # Only the upserted products need new fragments
+        updated.fragments = [self.fragments[s] if s < n_old else None for s in source]
+        for row, fragment in zip(rows, updated._render_fragments(rows)):
+            updated.fragments[row] = fragment
+
+        # The user-item matrix gains empty columns for the new products
+        if self.user_item_matrix is not None and added.any():
+            matrix = self.user_item_matrix
+            updated._set_user_cf(
+                self.user_ids,
+                sparse.csr_matrix(
+                    (matrix.data, matrix.indices, matrix.indptr),
+                    shape=(matrix.shape[0], len(source)),
+                ),
+                self.interaction_count,
+            )
+        return updated
 
-        user_vector = self.user_item_matrix.loc[user_id].values.reshape(1, -1)
-        distances, indices = self.user_cf_model.kneighbors(user_vector, n_neighbors=6)
+    def _build_neighbors(self, neighbor_k):
+        n_products = self.tfidf_matrix.shape[0]
+        if neighbor_k is None or neighbor_k > n_products - 1:
+            neighbor_k = max(n_products - 1, 0)
 
-        similar_users = self.user_item_matrix.index[
-            indices.flatten()[1:]
-        ]  # exclude self
+        self.neighbor_k = neighbor_k
+        self.neighbor_indices, self.neighbor_scores = _neighbor_table(
+            self._unit_matrix, neighbor_k
+        )
+        self._build_item_neighbor_matrix()
+
+    def _build_item_neighbor_matrix(self):
+        # The neighbor table as a sparse item x item matrix, sharing its buffers
+        n_products, neighbor_k = self.neighbor_indices.shape
+        self.item_neighbor_matrix = sparse.csr_matrix(
+            (
+                self.neighbor_scores.ravel(),
+                self.neighbor_indices.ravel(),
+                np.arange(n_products + 1) * neighbor_k,
+            ),
+            shape=(n_products, n_products),
+        )
 
-        # Aggregate product scores from similar users
-        recommendations = (
-            self.user_item_matrix.loc[similar_users].sum().sort_values(ascending=False)
+    def _build_catalog_indexes(self):
+        self._build_attribute_codes()
+        self._build_postings()
+        self._build_price_index()
+
+    def _build_attribute_codes(self):
+        self.attribute_codes = {}
+        self.attribute_values = {}
+        for column in ATTRIBUTE_COLUMNS:
+            codes, values = pd.factorize(self.products_df[column])
+            self.attribute_codes[column] = codes.astype(np.int32)
+            self.attribute_values[column] = values
+
+    def _build_postings(self):
+        # Inverted index per attribute: the rows holding each code are
+        # posting_rows[offsets[code]:offsets[code + 1]], in ascending order.
+        self.posting_rows = {}
+        self.posting_offsets = {}
+        for column, codes in self.attribute_codes.items():
+            counts = np.bincount(codes, minlength=len(self.attribute_values[column]))
+            self.posting_rows[column] = np.argsort(codes, kind="stable").astype(
+                np.int32
+            )
+            self.posting_offsets[column] = np.concatenate(
+                [[0], np.cumsum(counts)]
+            ).astype(np.int64)
+
+    def _build_price_index(self):
+        # Rows with a price, ordered by price; a second copy is grouped by
+        # category (price order within each group) with offsets per code.
+        self.prices = pd.to_numeric(
+            self.products_df["price"], errors="coerce"
+        ).to_numpy(dtype=np.float64)
+        priced = np.flatnonzero(~np.isnan(self.prices))
+        order = priced[np.argsort(self.prices[priced], kind="stable")]
+        self.price_order = order.astype(np.int32)
+        self.price_sorted = self.prices[order]
+
+        categories = self.attribute_codes["category"][order]
+        by_category = np.argsort(categories, kind="stable")
+        counts = np.bincount(
+            categories, minlength=len(self.attribute_values["category"])
+        )
+        self.category_price_order = self.price_order[by_category]
+        self.category_price_sorted = self.price_sorted[by_category]
+        self.category_price_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(
+            np.int64
         )
 
-        # Remove products the current user has already interacted with
-        already_seen = self.user_item_matrix.loc[user_id]
-        recommendations = recommendations[
-            ~recommendations.index.isin(already_seen[already_seen > 0].index)
+    def _postings(self, column, code):
+        offsets = self.posting_offsets[column]
+        return self.posting_rows[column][offsets[code] : offsets[code + 1]]
+
+    def _result_frame(self, rows):
+        with stage("frame"):
+            frame = self.products_df.iloc[rows][RESULT_COLUMNS]
+            prices = frame["price"]
+            if prices.dtype == np.float32:
+                # Show compact prices to the cent they were entered with, and
+                # missing ones as "" like the text-cleaned frames do
+                prices = prices.astype(np.float64).round(2)
+                frame = frame.assign(
+                    price=prices.astype(object).where(prices.notna(), "")
+                )
+            return frame
+
+    def _render_fragments(self, rows):
+        # Serialized like jsonify: sorted keys, compact, ASCII-only
+        records = self._result_frame(rows).to_dict(orient="records")
+        return [
+            json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+            for record in records
         ]
 
-        # Get top N recommendations
-        top_products = recommendations.head(top_n).index.tolist()
-
-        return self.products_df[self.products_df["product_id"].isin(top_products)][
-            [
-                "product_id",
-                "product_name",
-                "category",
-                "brand",
-                "material",
-                "price",
-                "image_url",
-                "product_url",
-            ]
-        ]
+    def _build_fragments(self):
+        # One JSON object per product; responses join them without pandas
+        self.fragments = self._render_fragments(np.arange(len(self.products_df)))
+
+    def _similarities(self, idx, rows):
+        # Exact similarities of one product against the given rows
+        return (self._unit_matrix[rows] @ self._unit_matrix[idx].T).toarray().ravel()
+
+    def _prepare_user_cf(self, interactions):
+        # interactions: a DataFrame, DataFrame chunks or an InteractionBuffer
+        buffer = InteractionBuffer.from_frames(interactions)
+        user_ids, product_ids, scores = buffer.arrays()
+
+        # Users become matrix rows; products use their catalog row, and
+        # interactions with products missing from the catalog are dropped.
+        user_ids, users = np.unique(user_ids, return_inverse=True)
+        items = self.product_indices.index.get_indexer(product_ids)
+        known = items >= 0
+
+        # Sum weights for each (user, product) straight into CSR
+        matrix = sparse.coo_matrix(
+            (scores[known], (users[known], items[known])),
+            shape=(len(user_ids), len(self.products_df)),
+        ).tocsr()
+        matrix.eliminate_zeros()
+
+        self._set_user_cf(user_ids, matrix, buffer.count)
+        self.interaction_watermark = buffer.watermark
+        self._build_user_neighbors()
+
+    def _set_user_cf(self, user_ids, user_item_matrix, interaction_count):
+        self.user_ids = user_ids
+        self.user_indices = pd.Series(np.arange(len(user_ids)), index=user_ids)
+        self.user_item_matrix = user_item_matrix
+        self.item_user_matrix = user_item_matrix.tocsc()
+        self.interaction_count = interaction_count
+
+    def _build_user_neighbors(self):
+        # Nearest users for every user, computed once for the whole table
+        self.user_neighbor_indices, self.user_neighbor_scores = _neighbor_table(
+            normalize(self.user_item_matrix), USER_NEIGHBOR_K
+        )
 
-    def get_personalized_recommendations(self, user_id, top_n=5):
-        if self.user_cf_model is None:
-            return "Collaborative filtering not initialized."
+    def with_interactions(self, interactions):
+        """Return a new engine with interactions added to the user CF data.
+
+        Product-side structures are shared with this engine, which is left
+        unchanged. Only the users with new activity, plus the users whose
+        neighbor lists they enter or leave, get their neighbors recomputed.
+        """
+        updated = copy.copy(self)
+        if self.user_item_matrix is None:
+            updated._prepare_user_cf(interactions)
+            return updated
+
+        # New users are appended after the existing rows
+        buffer = InteractionBuffer.from_frames(interactions)
+        delta_users, product_ids, scores = buffer.arrays()
+        new_ids = np.setdiff1d(np.unique(delta_users), self.user_ids)
+        user_ids = np.concatenate([self.user_ids, new_ids])
+        users = pd.Index(user_ids).get_indexer(delta_users)
+        items = self.product_indices.index.get_indexer(product_ids)
+        known = items >= 0
+
+        shape = (len(user_ids), len(self.products_df))
+        delta = sparse.coo_matrix(
+            (scores[known], (users[known], items[known])), shape=shape
+        ).tocsr()
+        previous = self.user_item_matrix
+        if len(new_ids):
+            padding = sparse.csr_matrix((len(new_ids), shape[1]), dtype=previous.dtype)
+            previous = sparse.vstack([previous, padding], format="csr")
+        matrix = (previous + delta).tocsr()
+        matrix.eliminate_zeros()
+
+        updated._set_user_cf(user_ids, matrix, self.interaction_count + buffer.count)
+        watermarks = [self.interaction_watermark, buffer.watermark]
+        watermarks = [w for w in watermarks if w is not None]
+        updated.interaction_watermark = max(watermarks) if watermarks else None
+
+        affected = np.union1d(
+            users[known], np.arange(len(self.user_ids), len(user_ids))
+        )
+        if self.user_neighbor_indices.shape[1] < min(
+            USER_NEIGHBOR_K, len(user_ids) - 1
+        ):
+            updated._build_user_neighbors()
+        else:
+            updated.user_neighbor_indices, updated.user_neighbor_scores = (
+                _patch_neighbor_table(
+                    normalize(matrix),
+                    self.user_neighbor_indices,
+                    self.user_neighbor_scores,
+                    affected,
+                )
+            )
+        return updated
+
+    def get_recommendation_rows(self, rec_type, ids, top_n=5, same_category=False):
+        """Catalog rows recommended for a batch of ids of one type.
+
+        rec_type is one of RECOMMENDATION_TYPES; ids are user ids for "cf"
+        and "personalized", product ids otherwise. top_n is one value or one
+        per id. Returns an array of rows or an error string per id.
+        """
+        if rec_type == "cf":
+            return self._user_to_user_rows(ids, top_n)
+        if rec_type == "personalized":
+            return self._personalized_rows(ids, top_n)
+        if rec_type == "content":
+            return self._product_to_product_rows(ids, top_n)
+
+        top_n = np.broadcast_to(top_n, len(ids))
+        return [
+            self._price_rows(product_id, n, same_category)
+            for product_id, n in zip(ids, top_n)
+        ]
 
-        if user_id not in self.user_item_matrix.index:
-            return f"User ID {user_id} not found in interaction data."
+    def render_json(self, rows):
+        """JSON array (bytes) of the public fields of rows, from fragments"""
+        fragments = self.fragments
+        with stage("render"):
+            return ("[" + ",".join([fragments[row] for row in rows]) + "]").encode()
 
-        user_scores = self.user_item_matrix.loc[user_id].copy()
-        top_interactions = user_scores.sort_values(ascending=False)
+    def _frames(self, results):
+        return [
+            result if isinstance(result, str) else self._result_frame(result)
+            for result in results
+        ]
 
-        # Remove already seen and score 0
-        top_interactions = top_interactions[top_interactions > 0]
-        unseen_products = self.user_item_matrix.columns.difference(
-            top_interactions.index
-        )
+    def get_user_to_user_recommendations(self, user_id, top_n=5):
+        return self.get_user_to_user_recommendations_batch([user_id], top_n)[0]
+
+    def get_user_to_user_recommendations_batch(self, user_ids, top_n=5):
+        """get_user_to_user_recommendations for many users in one pass.
+
+        top_n is one value or one per user. Returns a DataFrame or an error
+        string per user, in input order.
+        """
+        return self._frames(self._user_to_user_rows(user_ids, top_n))
+
+    def _user_to_user_rows(self, user_ids, top_n):
+        if self.user_item_matrix is None:
+            return ["Collaborative filtering not initialized."] * len(user_ids)
+
+        with stage("lookup"):
+            rows = self.user_indices.index.get_indexer(user_ids)
+            found = np.flatnonzero(rows >= 0)
+        top_n = np.broadcast_to(top_n, len(user_ids))
+        results = [
+            f"User ID {user_id} not found in interaction data." for user_id in user_ids
+        ]
 
-        # If everything has been seen, fallback to product-based recommendations
-        if len(unseen_products) == 0:
-            return self.get_product_to_product_recommendations(
-                top_interactions.index[0], num_recs=top_n
+        # Aggregate product scores from similar users: a batch x users
+        # selection matrix times the user-item matrix
+        with stage("rank"):
+            similar_users = self.user_neighbor_indices[rows[found]]
+            selection = sparse.csr_matrix(
+                (
+                    np.ones(similar_users.size, dtype=np.float32),
+                    similar_users.ravel(),
+                    np.arange(len(found) + 1) * similar_users.shape[1],
+                ),
+                shape=(len(found), len(self.user_ids)),
             )
 
-        # Recommend similar products based on user preferences
-        recommendations = []
-        for prod_id in top_interactions.index:
-            similar = self.get_product_to_product_recommendations(prod_id, num_recs=1)
-            recommendations.extend(similar.to_dict(orient="records"))
-            if len(recommendations) >= top_n:
-                break
-
-        return pd.DataFrame(recommendations[:top_n])
+            # Remove products the current user has already interacted with
+            totals = _unseen_scores(
+                selection @ self.user_item_matrix, self.user_item_matrix[rows[found]]
+            )
 
-    def get_product_to_product_recommendations(self, product_id, num_recs=5):
-        if product_id not in self.product_indices:
-            return f"Product ID {product_id} not found."
-
-        idx = self.product_indices[product_id]
-        target = self.products_df.iloc[idx]
-
-        sim_scores = list(enumerate(self.cosine_sim[idx]))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[1:]
-
-        recommendations = []
-
-        def filter_and_add(condition, count):
-            nonlocal recommendations, sim_scores
-            added = 0
-            for i, _ in sim_scores:
-                candidate = self.products_df.iloc[i]
-                if (
-                    condition(candidate)
-                    and candidate["product_id"] != product_id
-                    and candidate["product_id"]
-                    not in [r["product_id"] for r in recommendations]
-                ):
-                    recommendations.append(candidate)
-                    added += 1
-                    if added == count:
-                        break
-
-        filter_and_add(
-            lambda p: (
-                p["category"] == target["category"]
-                or p["subcategory"] == target["subcategory"]
-            ),
-            2,
-        )
+            # Get top N recommendations, listed in catalog order
+            ranked = _top_k_sparse_rows(totals, top_n[found].max(initial=0))
+        for position, top_products in zip(found, ranked):
+            results[position] = np.sort(top_products[: top_n[position]])
+        return results
 
-        filter_and_add(lambda p: p["brand"] == target["brand"], 2)
-        filter_and_add(lambda p: p["material"] == target["material"], 1)
-
-        return pd.DataFrame(recommendations)[
-            [
-                "product_id",
-                "product_name",
-                "category",
-                "brand",
-                "material",
-                "price",
-                "image_url",
-                "product_url",
-            ]
+    def get_personalized_recommendations(self, user_id, top_n=5):
+        return self.get_personalized_recommendations_batch([user_id], top_n)[0]
+
+    def get_personalized_recommendations_batch(self, user_ids, top_n=5):
+        """get_personalized_recommendations for many users in one pass.
+
+        top_n is one value or one per user. Returns a DataFrame or an error
+        string per user, in input order.
+        """
+        return self._frames(self._personalized_rows(user_ids, top_n))
+
+    def _personalized_rows(self, user_ids, top_n):
+        if self.user_item_matrix is None:
+            return ["Collaborative filtering not initialized."] * len(user_ids)
+
+        with stage("lookup"):
+            rows = self.user_indices.index.get_indexer(user_ids)
+            found = np.flatnonzero(rows >= 0)
+        top_n = np.broadcast_to(top_n, len(user_ids))
+        results = [
+            f"User ID {user_id} not found in interaction data." for user_id in user_ids
         ]
 
-    def get_price_based_recommendations(self, product_id, top_n=5):
-        if product_id not in self.product_indices:
-            return f"Product ID {product_id} not found."
-
-        target_price = self.products_df.loc[
-            self.products_df["product_id"] == product_id, "price"
-        ].values[0]
-
-        price_df = self.products_df.copy()
-        price_df["price_diff"] = (price_df["price"] - target_price).abs()
-        price_df = price_df[price_df["product_id"] != product_id]
-        closest = price_df.sort_values(by="price_diff").head(top_n)
-
-        return closest[
-            [
-                "product_id",
-                "product_name",
-                "category",
-                "brand",
-                "material",
-                "price",
-                "image_url",
-                "product_url",
-            ]
-        ]
+        # Item-based scoring: each user's interaction scores spread over the
+        # neighbors of every product they touched, one sparse product for
+        # the whole batch.
+        with stage("rank"):
+            user_rows = self.user_item_matrix[rows[found]]
+            scores = _unseen_scores(user_rows @ self.item_neighbor_matrix, user_rows)
+            ranked = _top_k_sparse_rows(scores, top_n[found].max(initial=0))
+
+        fallbacks = []
+        for i, (position, candidates) in enumerate(zip(found, ranked)):
+            start, stop = user_rows.indptr[i], user_rows.indptr[i + 1]
+            if start == stop:
+                results[position] = np.empty(0, dtype=np.intp)
+            elif len(candidates) == 0:
+                # Everything has been seen: product-based from the top interaction
+                top = start + np.argmax(user_rows.data[start:stop])
+                fallbacks.append((position, user_rows.indices[top]))
+            else:
+                results[position] = candidates[: top_n[position]]
+
+        if fallbacks:
+            positions, items = zip(*fallbacks)
+            product_ids = self.products_df["product_id"].to_numpy()[list(items)]
+            fallback_rows = self._product_to_product_rows(
+                product_ids, [top_n[p] for p in positions]
+            )
+            for position, chosen in zip(positions, fallback_rows):
+                results[position] = chosen
+        return results
+
+    def get_product_to_product_recommendations(self, product_id, num_recs=5):
+        return self.get_product_to_product_recommendations_batch([product_id])[0]
+
+    def get_product_to_product_recommendations_batch(self, product_ids, top_n=None):
+        """get_product_to_product_recommendations for many products in one pass.
+
+        top_n (one value or one per product) trims each list; by default the
+        quotas decide the length. Returns a DataFrame or an error string per
+        product, in input order.
+        """
+        return self._frames(self._product_to_product_rows(product_ids, top_n))
+
+    def _product_to_product_rows(self, product_ids, top_n):
+        with stage("lookup"):
+            rows = self.product_indices.index.get_indexer(product_ids)
+            found = np.flatnonzero(rows >= 0)
+        top_n = np.broadcast_to(np.asarray(top_n, dtype=object), len(product_ids))
+        results = [f"Product ID {product_id} not found." for product_id in product_ids]
+
+        with stage("quotas"):
+            chosen_rows = self._fill_quotas(rows[found])
+        for position, chosen in zip(found, chosen_rows):
+            results[position] = chosen[: top_n[position]]
+        return results
+
+    def _fill_quotas(self, idxs):
+        # Walk the quotas in order, taking each target's best-ranked unused
+        # neighbors that share its attributes, for all targets at once. A
+        # quota the neighbor table cannot fill is ranked exactly over the
+        # attribute posting lists.
+        full_table = self.neighbor_k >= len(self.products_df) - 1
+        rankings = self.neighbor_indices[idxs]
+        taken = np.zeros(rankings.shape, dtype=bool)
+        chosen = [[np.empty(0, dtype=np.intp)] for _ in idxs]
+        for columns, count in QUOTAS:
+            matches = np.zeros(rankings.shape, dtype=bool)
+            for column in columns:
+                codes = self.attribute_codes[column]
+                matches |= codes[rankings] == codes[idxs][:, None]
+
+            eligible = matches & ~taken
+            hits = eligible & (np.cumsum(eligible, axis=1) <= count)
+            taken |= hits
+            for i, idx in enumerate(idxs):
+                row_hits = rankings[i][hits[i]]
+                if len(row_hits) < count and not full_table:
+                    row_hits = self._rank_postings(
+                        idx, columns, np.concatenate(chosen[i]), count
+                    )
+                    chosen[i].append(row_hits)
+                    taken[i] = np.isin(rankings[i], np.concatenate(chosen[i]))
+                else:
+                    chosen[i].append(row_hits)
+
+        return [np.concatenate(parts) for parts in chosen]
+
+    def _rank_postings(self, idx, columns, exclude, count):
+        rows = self._postings(columns[0], self.attribute_codes[columns[0]][idx])
+        for column in columns[1:]:
+            rows = np.union1d(
+                rows, self._postings(column, self.attribute_codes[column][idx])
+            )
+        rows = rows[(rows != idx) & ~np.isin(rows, exclude)]
+
+        scores = self._similarities(idx, rows)
+        return rows[_top_k_positions(scores, count)]
+
+    def get_price_based_recommendations(self, product_id, top_n=5, same_category=False):
+        result = self._price_rows(product_id, top_n, same_category)
+        return result if isinstance(result, str) else self._result_frame(result)
+
+    def _price_rows(self, product_id, top_n, same_category):
+        with stage("lookup"):
+            if product_id not in self.product_indices:
+                return f"Product ID {product_id} not found."
+            idx = self.product_indices[product_id]
+
+        with stage("price_walk"):
+            return self._walk_prices(idx, product_id, top_n, same_category)
+
+    def _walk_prices(self, idx, product_id, top_n, same_category):
+        target_price = self.prices[idx]
+        if np.isnan(target_price):
+            return f"Product ID {product_id} has no price."
+
+        if same_category:
+            code = self.attribute_codes["category"][idx]
+            offsets = self.category_price_offsets
+            window = slice(offsets[code], offsets[code + 1])
+            sorted_prices = self.category_price_sorted[window]
+            order = self.category_price_order[window]
+        else:
+            sorted_prices = self.price_sorted
+            order = self.price_order
+
+        # Walk outward from the target price, always taking the closer side
+        right = np.searchsorted(sorted_prices, target_price)
+        left = right - 1
+        closest = []
+        while len(closest) < top_n and (left >= 0 or right < len(sorted_prices)):
+            if right >= len(sorted_prices) or (
+                left >= 0
+                and target_price - sorted_prices[left]
+                <= sorted_prices[right] - target_price
+            ):
+                row = order[left]
+                left -= 1
+            else:
+                row = order[right]
+                right += 1
+            if row != idx:
+                closest.append(row)
+
+        return closest
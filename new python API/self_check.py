@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Equivalence self-check for the recommendation engine's fast paths.
+
+Builds a small synthetic engine (the generators from benchmark.py) and
+checks that each shortcut gives exactly what the straightforward version
+gives:
+
+- top-k selection against a stable sort of every value
+- sparse neighbor tables against a dense similarity matrix
+- patched neighbor tables (with_products, with_interactions) against
+  tables rebuilt in full
+- prebuilt JSON fragments and render_json against jsonify
+
+    python self_check.py
+    python self_check.py --products 5000 --events 100000 --seed 7
+
+Exits non-zero when any check finds a mismatch.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+from flask import Flask, jsonify
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from benchmark import EVENTS_PER_USER, interaction_chunks, make_products
+from build_model import ModelBuilder
+from recommendations import (
+    USER_NEIGHBOR_K,
+    _neighbor_table,
+    _top_k_positions,
+    _top_k_sparse_rows,
+)
+
+
+def stable_top_k(values, k):
+    """Reference top-k: a stable descending sort over all of values"""
+    return np.argsort(-values, kind="stable")[:k]
+
+
+def dense_neighbor_table(unit_matrix, k):
+    """Reference neighbor table from the full dense similarity matrix"""
+    sims = (unit_matrix @ unit_matrix.T.tocsr()).toarray()
+    np.fill_diagonal(sims, -np.inf)
+    indices = np.argsort(-sims, axis=1, kind="stable")[:, :k]
+    return indices, np.take_along_axis(sims, indices, axis=1)
+
+
+def table_mismatches(actual, expected):
+    """Rows where two (indices, scores) neighbor tables differ"""
+    (indices, scores), (ref_indices, ref_scores) = actual, expected
+    if indices.shape != ref_indices.shape:
+        return max(len(indices), len(ref_indices))
+    differs = (indices != ref_indices).any(axis=1)
+    differs |= (scores != ref_scores.astype(scores.dtype)).any(axis=1)
+    return int(differs.sum())
+
+
+def check_top_k(rng, trials=500):
+    mismatches = 0
+    for _ in range(trials):
+        # Few distinct values, so most selections cut through a tie
+        values = rng.integers(0, 5, rng.integers(1, 60)).astype(np.float32)
+        for k in (1, 3, len(values) // 2, len(values)):
+            top = _top_k_positions(values, k)
+            mismatches += not np.array_equal(top, stable_top_k(values, k))
+    return mismatches
+
+
+def check_sparse_rows(rng, rows=300, columns=400):
+    matrix = sparse.random(rows, columns, density=0.05, format="csr", random_state=rng)
+    matrix.data = np.round(matrix.data * 4)  # ties again
+    matrix.eliminate_zeros()
+    mismatches = 0
+    for k in (1, 5, 20):
+        for row, top in enumerate(_top_k_sparse_rows(matrix, k)):
+            dense = matrix[row].toarray().ravel()
+            stored = np.zeros(columns, dtype=bool)
+            stored[matrix[row].indices] = True
+            expected = [c for c in stable_top_k(dense, columns) if stored[c]][:k]
+            mismatches += not np.array_equal(top, expected)
+    return mismatches
+
+
+def check_neighbor_table(rec):
+    unit_matrix = rec._unit_matrix
+    k = rec.neighbor_indices.shape[1]
+    return table_mismatches(
+        _neighbor_table(unit_matrix, k), dense_neighbor_table(unit_matrix, k)
+    )
+
+
+def check_product_patch(rec, updated):
+    k = rec.neighbor_indices.shape[1]
+    full = _neighbor_table(updated._unit_matrix, k)
+    return table_mismatches((updated.neighbor_indices, updated.neighbor_scores), full)
+
+
+def check_user_patch(updated):
+    k = min(USER_NEIGHBOR_K, len(updated.user_ids) - 1)
+    full = _neighbor_table(normalize(updated.user_item_matrix), k)
+    return table_mismatches(
+        (updated.user_neighbor_indices, updated.user_neighbor_scores), full
+    )
+
+
+def check_fragments(rec, rng, responses=200):
+    rows = np.arange(len(rec.products_df))
+    mismatches = sum(
+        fragment != expected
+        for fragment, expected in zip(rec.fragments, rec._render_fragments(rows))
+    )
+    mismatches += len(rec.fragments) != len(rows)
+
+    with Flask(__name__).app_context():
+        for _ in range(responses):
+            picked = rng.choice(rows, rng.integers(0, 11), replace=False)
+            records = rec._result_frame(picked).to_dict(orient="records")
+            expected = jsonify(records).get_data().rstrip(b"\n")
+            mismatches += rec.render_json(picked) != expected
+    return mismatches
+
+
+def edited_products(rng, products_df, count):
+    """Existing products with new names, plus as many new products"""
+    edited = products_df.sample(count, random_state=rng).copy()
+    donors = products_df["product_name"].sample(count, random_state=rng)
+    edited["product_name"] = [
+        f"{name} {donor}" for name, donor in zip(edited["product_name"], donors)
+    ]
+    added = make_products(rng, count)
+    added["product_id"] += int(products_df["product_id"].max())
+    return [edited, added]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=2_000)
+    parser.add_argument("--events", type=int, default=40_000)
+    parser.add_argument("--neighbor-k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    users = max(100, args.events // EVENTS_PER_USER)
+    products_df = make_products(rng, args.products)
+    product_ids = products_df["product_id"].to_numpy()
+    # build() trims the frame it is given; keep the full one for the upserts
+    rec = ModelBuilder(cache=None, neighbor_k=args.neighbor_k).build(
+        products_df.copy(), interaction_chunks(rng, product_ids, users, args.events)
+    )
+
+    updated = rec
+    for batch in edited_products(rng, products_df, max(args.products // 100, 1)):
+        updated = updated.with_products(batch)
+    # Drawn over twice as many users, so the delta brings new users too
+    delta = next(interaction_chunks(rng, product_ids, 2 * users, args.events // 10))
+    updated = updated.with_interactions(delta)
+
+    checks = {
+        "top-k tie-breaking": lambda: check_top_k(rng),
+        "sparse row top-k": lambda: check_sparse_rows(rng),
+        "sparse neighbor table": lambda: check_neighbor_table(rec),
+        "patched product neighbors": lambda: check_product_patch(rec, updated),
+        "patched user neighbors": lambda: check_user_patch(updated),
+        "JSON fragments": lambda: check_fragments(rec, rng),
+        "patched JSON fragments": lambda: check_fragments(updated, rng),
+    }
+    failed = False
+    for name, check in checks.items():
+        mismatches = check()
+        if mismatches:
+            failed = True
+            print(f"❌ {name}: {mismatches} mismatches")
+        else:
+            print(f"✅ {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
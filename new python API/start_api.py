@@ -3,6 +3,7 @@
 Startup script for the Python Recommendation API (PostgreSQL version)
 """
 
+import json
 import os
 import sys
 import subprocess
@@ -10,16 +11,11 @@ import time
 from pathlib import Path
 
 
-def check_dependencies():
+def check_dependencies(asgi=False):
     """Check if required Python packages are installed"""
-    required_packages = [
-        "flask",
-        "flask_cors",
-        "sqlalchemy",
-        "psycopg2",
-        "pandas",
-        "sklearn",
-    ]
+    required_packages = ["flask", "flask_cors", "sqlalchemy", "pandas", "sklearn"]
+    if asgi:
+        required_packages.append("uvicorn")
 
     missing_packages = []
 
@@ -29,8 +25,6 @@ def check_dependencies():
                 import flask_cors
             elif package == "sklearn":
                 import sklearn
-            elif package == "psycopg2":
-                import psycopg2
             else:
                 __import__(package)
         except ImportError:
@@ -45,24 +39,27 @@ def check_dependencies():
     return True
 
 
-def check_database_connection():
-    """Check if the PostgreSQL database is accessible"""
+def open_data_source():
+    """Open the data source app.py will read, or None if it cannot be opened"""
     try:
-        from sqlalchemy import create_engine
-        import pandas as pd
+        from data_sources import open_source
+        from db import DATABASE_URL
 
-        # Database configuration
-        host = "localhost"
-        user = "postgres"
-        password = "1234"
-        database = "Macromed"
-        port = 5432
+        return open_source(os.environ.get("MACROMED_DATA_SOURCE", DATABASE_URL))
+    except ImportError as e:
+        # Database drivers and pyarrow are only needed by some sources
+        print(f"❌ Missing required package for the data source: {e}")
+    except Exception as e:
+        print(f"❌ Invalid data source: {e}")
+    return None
 
-        engine = create_engine(
-            f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
-        )
 
-        # Try to load products table
+def check_database_connection(engine):
+    """Check if the PostgreSQL database is accessible"""
+    try:
+        import pandas as pd
+
+        # Try to load products table over the source's shared, pooled engine
         products_df = pd.read_sql("SELECT * FROM products LIMIT 1", engine)
         print(f"✅ Database connection successful. Found {len(products_df)} products")
         return True
@@ -77,9 +74,30 @@ def check_database_connection():
         return False
 
 
-def start_api():
-    """Start the Flask API"""
-    print("🚀 Starting Python Recommendation API...")
+def check_snapshot(path):
+    """Check that a Parquet snapshot is readable"""
+    try:
+        from data_sources import SNAPSHOT_MANIFEST
+
+        with open(os.path.join(path, SNAPSHOT_MANIFEST)) as f:
+            manifest = json.load(f)
+        print(
+            f"✅ Snapshot found with {manifest['products']} products and"
+            f" {manifest['interactions']} interactions"
+        )
+        return True
+
+    except Exception as e:
+        print(f"❌ Snapshot check failed: {e}")
+        print("Create one with: python data_sources.py export --output <dir>")
+        return False
+
+
+def start_api(asgi=False, workers=None):
+    """Start the Flask API, its ASGI entry point with --asgi or the
+    multi-worker launcher with --workers N"""
+    mode = " (ASGI)" if asgi else f" ({workers} workers)" if workers else ""
+    print(f"🚀 Starting Python Recommendation API{mode}...")
     print("📍 API will be available at: http://localhost:5000")
     print("📋 Available endpoints:")
     print("   - GET /api/recommend?product_id=<id>&type=<content|price>")
@@ -89,7 +107,11 @@ def start_api():
     print("\n" + "=" * 50)
 
     try:
-        subprocess.run([sys.executable, "app.py"], check=True)
+        if workers:
+            command = ["prefork.py", "--workers", str(workers)]
+        else:
+            command = ["asgi.py" if asgi else "app.py"]
+        subprocess.run([sys.executable, *command], check=True)
     except KeyboardInterrupt:
         print("\n🛑 API stopped by user")
     except Exception as e:
@@ -106,15 +128,34 @@ def main():
         print("❌ app.py not found. Please run this script from the API directory")
         sys.exit(1)
 
-    # Check dependencies and DB
-    if not check_dependencies():
+    asgi = "--asgi" in sys.argv[1:]
+    workers = None
+    if "--workers" in sys.argv[1:]:
+        try:
+            workers = int(sys.argv[sys.argv.index("--workers") + 1])
+        except (IndexError, ValueError):
+            print("❌ --workers needs a number of worker processes")
+            sys.exit(1)
+
+    # Check dependencies and the DB or snapshot app.py will read
+    if not check_dependencies(asgi):
         sys.exit(1)
 
-    if not check_database_connection():
+    source = open_data_source()
+    if source is None:
+        sys.exit(1)
+
+    from data_sources import ParquetSource
+
+    if isinstance(source, ParquetSource):
+        ready = check_snapshot(source.path)
+    else:
+        ready = check_database_connection(source.engine)
+    if not ready:
         sys.exit(1)
 
     # Start the Flask server
-    start_api()
+    start_api(asgi, workers)
 
 
 if __name__ == "__main__":